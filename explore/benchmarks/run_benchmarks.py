@@ -0,0 +1,233 @@
+import numpy as np, pandas as pd
+import os, sys, json, time, datetime, platform, resource, subprocess, tempfile, argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+explore_dir = os.path.join(here, '..')
+sys.path.append(explore_dir)
+sys.path.append(os.path.join(explore_dir, 'binning'))
+import synthetic
+
+"""Goal: time our hot paths on synthetic data, offline, and keep the numbers for comparing commits.
+
+Each (case, size) runs in its own python subprocess, so peak RSS (ru_maxrss) belongs to that
+case alone. The child builds its data (untimed), runs the function `repeat` times and reports
+wall times, RSS after setup and peak RSS. Throughput is cells / best wall time, where a cell is
+one input count (a county, a table row, a csv value or a person record, see CASES).
+
+    python run_benchmarks.py                          quick sizes, every case
+    python run_benchmarks.py --full                   sizes up to K = 10^6 / all of WA's blocks
+    python run_benchmarks.py --cases gdpc read_decennial --sizes 1000 100000
+    python run_benchmarks.py --compare old.json new.json
+
+Results go to bench_results/<date>-<commit>.json (or --out) with the git commit they ran on.
+"""
+
+def _gdpc(size, tmp, rng):
+    from min_majority_fns import GDPC
+    counts = synthetic.county_counts(int(size), rng)
+    return (lambda: GDPC(1.0, counts, rng)), len(counts)
+
+def _nonnegative_optimize(size, tmp, rng):
+    from min_majority_fns import GDPC, nonnegative_optimize
+    counts = synthetic.county_counts(int(size), rng)
+    noisy = GDPC(0.1, counts, rng).to_numpy(dtype=float)
+    return (lambda: nonnegative_optimize(noisy, counts.sum())), len(noisy)
+
+def _post_proc(size, tmp, rng):
+    from post_processing_and_viz import post_proc
+    df = synthetic.decennial_long(int(size), rng)
+    noisy = df.pop_count.to_numpy() + rng.laplace(0, 10., len(df))
+    return (lambda: post_proc(noisy, df.pop_count.sum())), len(df)
+
+def _das(size, tmp, rng):
+    from post_processing_and_viz import das
+    df = synthetic.decennial_long(int(size), rng)
+    return (lambda: das(df, 'pop_count', 10., run_seed=1)), len(df)
+
+def _generate_single_year_df(size, tmp, rng):
+    from sample_data import generate_single_year_df, AgeLookup
+    df = synthetic.decennial_long(int(size), rng)
+    lookup = AgeLookup(synthetic.age_distribution(rng))
+    return (lambda: generate_single_year_df(df, lookup, rng)), len(df)
+
+def _format_acs(size, tmp, rng):
+    from process_acs import format_acs, acs_cols, acs_dtypes
+    df = synthetic.pums_persons(int(size), rng)
+    df.columns = df.columns.str.lower()
+    df['year'] = rng.choice([2015, 2016, 2017], len(df))
+    df = df[acs_cols].astype(acs_dtypes)
+    return (lambda: format_acs(df, ['racwht'], [2015, 2016, 2017])), len(df)
+
+def _read_acs_files(size, tmp, rng):
+    from process_acs import read_acs_files
+    years = [2015, 2016]
+    paths = {year: synthetic.write_pums_csv(os.path.join(tmp, 'psam_p53_' + str(year) + '.csv'),
+                                            int(size) // len(years), rng) for year in years}
+    return (lambda: read_acs_files(paths, 'WA', use_cache=False)), (int(size) // len(years)) * len(years)
+
+def _read_decennial(size, tmp, rng, use_cache = False):
+    import process_decennial, parquet_cache
+    table = process_decennial.sex_by_age_white_alone
+    synthetic.write_dhc_csv(os.path.join(tmp, 'WA2010DHCCSV', 'WA2010DHC.CSV'), int(size), [table], rng)
+    process_decennial.input_dir = tmp + os.sep
+    parquet_cache.cache_dir = os.path.join(tmp, 'cache')
+    if use_cache:
+        process_decennial.read_decennial(table, use_cache=True)
+    return (lambda: process_decennial.read_decennial(table, use_cache=use_cache)), int(size) * len(table)
+
+def _read_decennial_cached(size, tmp, rng):
+    return _read_decennial(size, tmp, rng, use_cache=True)
+
+def _aggregate_by_age(size, tmp, rng):
+    from post_processing_and_viz import aggregate_by_age
+    df = synthetic.single_year_long(int(size), rng=rng)
+    return (lambda: aggregate_by_age(df, 'pop_count', 'a1')), len(df)
+
+# name -> (setup, quick sizes, full sizes); setup(size, tmp_dir, rng) returns (fn to time, cells)
+# sizes are counties for gdpc/nonnegative_optimize, blocks for the decennial cases,
+# persons for the acs cases and geoids (x 3 races x 2 sexes x 121 ages) for aggregate_by_age
+CASES = {'gdpc': (_gdpc, [1e3, 1e4, 1e5], [1e3, 1e4, 1e5, 1e6]),
+         'nonnegative_optimize': (_nonnegative_optimize, [1e3, 1e4, 1e5], [1e3, 1e4, 1e5, 1e6]),
+         'post_proc': (_post_proc, [1e3, 1e4], [1e3, 1e4, 1e5]),
+         'das': (_das, [1e3, 1e4], [1e3, 1e4, 1e5]),
+         'generate_single_year_df': (_generate_single_year_df, [1e3, 1e4], [1e3, 1e4, 1e5]),
+         'format_acs': (_format_acs, [1e4, 1e5], [1e4, 1e5, 1e6]),
+         'read_acs_files': (_read_acs_files, [1e4, 1e5], [1e4, 1e5, 1e6]),
+         'read_decennial': (_read_decennial, [1e3, 1e4], [1e4, 1e5, synthetic.WA_BLOCKS]),
+         'read_decennial_cached': (_read_decennial_cached, [1e3, 1e4], [1e4, 1e5, synthetic.WA_BLOCKS]),
+         'aggregate_by_age': (_aggregate_by_age, [1e2, 1e3], [1e3, 1e4, 3e4])}
+
+def run_case(case, size, repeat = 3, seed = 0):
+    """ set up and time one case in this process (what each subprocess runs)
+
+    Results
+    -------
+    returns a dict with wall times, cells, cells/sec and RSS in MB
+    """
+    setup = CASES[case][0]
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory(prefix='census_dp_bench_') as tmp:
+        fn, cells = setup(size, tmp, rng)
+        rss_setup = _max_rss_mb()
+        walls = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn()
+            walls.append(time.perf_counter() - start)
+    best = min(walls)
+    return {'case': case, 'size': int(size), 'cells': int(cells), 'repeat': repeat,
+            'wall_s': best, 'wall_median_s': float(np.median(walls)), 'walls_s': walls,
+            'cells_per_s': cells / best if best > 0 else None,
+            'rss_setup_mb': rss_setup, 'peak_rss_mb': _max_rss_mb()}
+
+def run_all(cases = None, sizes = None, full = False, repeat = 3, seed = 0, timeout = None):
+    """ run each (case, size) in a fresh subprocess
+
+    Parameters
+    ----------
+    cases : case names (keys of CASES); defaults to all
+    sizes : sizes for every case; defaults to each case's quick (or full) sizes
+    full : use the full sizes
+    timeout : seconds before a case is killed and recorded as failed
+
+    Results
+    -------
+    returns a list of result dicts; failed cases have 'error' set
+    """
+    results = []
+    for case in cases or list(CASES):
+        if case not in CASES:
+            raise Exception("oops; no benchmark case " + case + "; cases are " + str(list(CASES)))
+        for size in sizes or CASES[case][2 if full else 1]:
+            cmd = [sys.executable, os.path.abspath(__file__), '--child', case, str(int(size)),
+                   '--repeat', str(repeat), '--seed', str(seed)]
+            env = dict(os.environ, MPLBACKEND='Agg')
+            try:
+                proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)
+                if proc.returncode == 0:
+                    result = json.loads(proc.stdout.strip().splitlines()[-1])
+                else:
+                    result = {'case': case, 'size': int(size), 'error': proc.stderr.strip().splitlines()[-1:]}
+            except subprocess.TimeoutExpired:
+                result = {'case': case, 'size': int(size), 'error': 'timed out after ' + str(timeout) + 's'}
+            print(_format_row(result), flush=True)
+            results.append(result)
+    return results
+
+def save_results(results, out = None, seed = 0):
+    """ write results with the commit, machine and library versions; returns the path
+    """
+    commit, dirty = _git_state()
+    now = datetime.datetime.now()
+    if out is None:
+        out = os.path.join('bench_results', now.strftime('%Y%m%d-%H%M%S') + '-' + (commit or 'nogit')[:10] + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    doc = {'commit': commit, 'dirty': dirty, 'started': now.isoformat(timespec='seconds'), 'seed': seed,
+           'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+           'machine': platform.platform(), 'cpu_count': os.cpu_count(), 'results': results}
+    with open(out, 'w') as f:
+        json.dump(doc, f, indent=1)
+    return out
+
+def compare(old_path, new_path):
+    """ wall time and peak RSS of new relative to old, per (case, size) in both runs
+
+    Results
+    -------
+    returns a pd.DataFrame; time_ratio < 1 means new is faster
+    """
+    def load(path):
+        with open(path) as f:
+            doc = json.load(f)
+        df = pd.DataFrame([i for i in doc['results'] if 'error' not in i])
+        return df.set_index(['case', 'size'])[['wall_s', 'peak_rss_mb']], doc['commit']
+    old, old_commit = load(old_path)
+    new, new_commit = load(new_path)
+    df = old.join(new, how='inner', lsuffix='_old', rsuffix='_new')
+    df['time_ratio'] = df.wall_s_new / df.wall_s_old
+    df['rss_ratio'] = df.peak_rss_mb_new / df.peak_rss_mb_old
+    df.attrs['commits'] = (old_commit, new_commit)
+    return df
+
+def _max_rss_mb():
+    # ru_maxrss is KB on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.**2 if sys.platform == 'darwin' else 1024.)
+
+def _git_state():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def _format_row(r):
+    if 'error' in r:
+        return '{:<24} {:>9}  FAILED: {}'.format(r['case'], r['size'], r['error'])
+    return '{:<24} {:>9}  {:>9.4f} s  {:>12.3g} cells/s  {:>8.1f} MB peak'.format(
+        r['case'], r['size'], r['wall_s'], r['cells_per_s'] or 0, r['peak_rss_mb'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='offline benchmarks of the DP noise, post-processing, sampling and ingest code')
+    parser.add_argument('--cases', nargs='+', help='cases to run: ' + ', '.join(CASES))
+    parser.add_argument('--sizes', nargs='+', type=float, help='sizes for every case, instead of the defaults')
+    parser.add_argument('--full', action='store_true', help='the larger default sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, help='seconds per case')
+    parser.add_argument('--out', help='results json path')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files')
+    parser.add_argument('--child', nargs=2, metavar=('CASE', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_case(args.child[0], float(args.child[1]), args.repeat, args.seed)))
+    elif args.compare:
+        df = compare(*args.compare)
+        print('old', df.attrs['commits'][0], 'new', df.attrs['commits'][1])
+        print(df.to_string(float_format='{:.4g}'.format))
+    else:
+        results = run_all(args.cases, args.sizes, args.full, args.repeat, args.seed, args.timeout)
+        print('saved', save_results(results, args.out, args.seed))
@@ -0,0 +1,151 @@
+import numpy as np, pandas as pd
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'binning'))
+from process_decennial import location_cols, decennial_age_starts, sex_by_age_white_alone
+
+"""Goal: offline stand-ins for the inputs our hot paths see, with the real shapes and dtypes.
+
+    dhc_blocks / write_dhc_csv    WA 2010 DHC file: STATE ... BLOCK plus one column per table var,
+                                  ~5% summary rows with blank geography, as read_decennial expects
+    pums_persons / write_pums_csv PUMS person file columns (upper case, as on disk)
+    age_distribution              single-year age distribution within each decennial age bin
+    decennial_long                read_decennial output: geoid/sex_id/age_start/age_end/pop_count
+    single_year_long              sample_single_year_age_distribution output: geoid/race/sex_id/age/pop_count
+    county_counts                 K county populations with a heavy right tail, as in the min/maj sims
+Everything is drawn from an explicit Generator, so a seed gives the same data on every machine.
+"""
+
+# WA 2010 has ~195k tabulation blocks across 39 counties
+WA_BLOCKS = 195_574
+WA_COUNTIES = 39
+
+def dhc_blocks(n_blocks, tables = (sex_by_age_white_alone,), rng = None, state = 53):
+    """ block-level DHC rows for the census vars in tables, plus summary rows
+
+    Parameters
+    ----------
+    n_blocks : number of block rows
+    tables : list of lists of census var names, e.g. [sex_by_age_white_alone]
+    rng : seed or np.random.Generator
+
+    Results
+    -------
+    returns a pd.DataFrame with location_cols then the table vars; summary rows have NaN geography
+    """
+    rng = np.random.default_rng(rng)
+    cols = [c for t in tables for c in t]
+    n_sum = max(1, n_blocks // 20)
+
+    county = 2 * rng.integers(0, WA_COUNTIES, n_blocks) + 1
+    blkgrp = rng.integers(1, 10, n_blocks)
+    loc = pd.DataFrame({'STATE': state, 'COUNTY': county, 'TRACT': rng.integers(100, 999_999, n_blocks),
+                        'BLKGRP': blkgrp, 'BLOCK': blkgrp * 1000 + rng.integers(0, 999, n_blocks)})
+    summary = pd.DataFrame({'STATE': [state] * n_sum}).assign(**{c: np.nan for c in location_cols[1:]})
+    df = pd.concat([summary, loc], ignore_index=True)
+
+    # most blocks are small: counts ~ Poisson with a block-level mean, many zeros
+    block_mean = rng.gamma(0.6, 2.0, len(df))[:, None]
+    vals = rng.poisson(block_mean, (len(df), len(cols))).astype(np.int32)
+    return pd.concat([df, pd.DataFrame(vals, columns=cols)], axis=1)
+
+def write_dhc_csv(path, n_blocks, tables = (sex_by_age_white_alone,), rng = None):
+    """ write dhc_blocks to path as csv; returns path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    dhc_blocks(n_blocks, tables, rng).to_csv(path, index=False)
+    return path
+
+def pums_persons(n, rng = None, state = 53):
+    """ PUMS person records with the columns process_acs reads (plus one it drops)
+
+    race flags are drawn independently with WA-like rates, and racnum is kept consistent
+    with them, so format_acs's checks pass
+    """
+    rng = np.random.default_rng(rng)
+    races = ['RACAIAN', 'RACASN', 'RACBLK', 'RACNH', 'RACPI', 'RACSOR', 'RACWHT']
+    flags = (rng.random((n, 7)) < np.array([.02, .08, .04, .005, .005, .05, .8])).astype(np.int8)
+    flags[flags.sum(1) == 0, 6] = 1
+
+    df = pd.DataFrame(flags, columns=races)
+    df.insert(0, 'SERIALNO', rng.integers(1_000_000, 9_000_000, n))
+    df.insert(1, 'ST', state)
+    df.insert(2, 'PWGTP', rng.integers(1, 300, n))
+    df.insert(3, 'AGEP', rng.integers(0, 96, n))
+    df.insert(4, 'SEX', rng.integers(1, 3, n))
+    # native hawaiian and pacific islander count as one race in racnum
+    df['RACNUM'] = flags[:, [0, 1, 2, 5, 6]].sum(1) + flags[:, [3, 4]].max(1)
+    df['HISP'] = np.where(rng.random(n) < .1, rng.integers(2, 25, n), 1)
+    df['PUMA'] = rng.integers(100, 11_900, n)
+    return df
+
+def write_pums_csv(path, n, rng = None, state = 53):
+    """ write pums_persons to path as csv; returns path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    pums_persons(n, rng, state).to_csv(path, index=False)
+    return path
+
+def age_distribution(rng = None):
+    """ sex_id/age/age_start/age_end/pop_count/pop_proportion within each decennial age bin,
+        the table sample_data.AgeLookup takes
+    """
+    rng = np.random.default_rng(rng)
+    edges = decennial_age_starts + [121]
+    sex, age, start, end = [], [], [], []
+    for s in [1, 2]:
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            sex += [s] * (hi - lo)
+            age += list(range(lo, hi))
+            start += [lo] * (hi - lo)
+            end += [hi - 1] * (hi - lo)
+    df = pd.DataFrame({'sex_id': sex, 'age': age, 'age_start': start, 'age_end': end})
+    # falling off with age inside the open-ended last bin, roughly flat elsewhere
+    df['pop_count'] = rng.uniform(1, 10, len(df)) * np.where(df.age >= 85, np.exp(-(df.age - 85) / 5.), 1.) * 100
+    df['pop_proportion'] = df.pop_count / df.groupby(['sex_id', 'age_start']).pop_count.transform('sum')
+    return df
+
+def _block_geoids(n_geo, rng):
+    county = 2 * rng.integers(0, WA_COUNTIES, n_geo) + 1
+    tract = rng.integers(100, 999_999, n_geo)
+    block = np.arange(n_geo) % 9000 + 1000
+    return np.char.add(np.char.add(np.char.add('53', np.char.zfill(county.astype(str), 3)),
+                                   np.char.zfill(tract.astype(str), 6)), block.astype(str)).astype(object)
+
+def decennial_long(n_geo, rng = None):
+    """ read_decennial-shaped long table: every geoid x sex x decennial age bin
+    """
+    rng = np.random.default_rng(rng)
+    geoids = _block_geoids(n_geo, rng)
+    n_bins = len(decennial_age_starts)
+    ends = decennial_age_starts[1:] + [121]
+    return pd.DataFrame({'geoid': np.repeat(geoids, 2 * n_bins),
+                         'sex_id': np.tile(np.repeat([1, 2], n_bins), n_geo),
+                         'age_start': np.tile(decennial_age_starts * 2, n_geo),
+                         'age_end': np.tile([i - 1 for i in ends] * 2, n_geo),
+                         'pop_count': rng.poisson(rng.gamma(0.6, 2.0, n_geo).repeat(2 * n_bins))})
+
+def single_year_long(n_geo, races = ('white', 'black', 'asian'), rng = None):
+    """ single-year-age long table: every geoid x race x sex x age 0 ... 120
+    """
+    rng = np.random.default_rng(rng)
+    geoids = _block_geoids(n_geo, rng)
+    per_geo = len(races) * 2 * 121
+    return pd.DataFrame({'geoid': np.repeat(geoids, per_geo),
+                         'race': np.tile(np.repeat(list(races), 2 * 121), n_geo),
+                         'sex_id': np.tile(np.repeat([1, 2], 121), n_geo * len(races)),
+                         'age': np.tile(np.arange(121), n_geo * len(races) * 2),
+                         'pop_count': rng.poisson(0.3, n_geo * per_geo).astype(np.int32)})
+
+def county_counts(K, rng = None, a = 1.5, b = 30., N = None):
+    """ K county populations, beta(a, b) shares of N people (defaults to 1,000 people per county),
+        as exact_counts for GDPC or nonnegative_optimize
+
+    Results
+    -------
+    returns an int64 pd.Series indexed 0 ... K-1
+    """
+    rng = np.random.default_rng(rng)
+    N = 1_000 * K if N is None else N
+    shares = rng.beta(a, b, K)
+    return pd.Series(rng.multinomial(N, shares / shares.sum()), dtype=np.int64)
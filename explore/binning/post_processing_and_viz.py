@@ -1,72 +1,122 @@
 import pandas as pd, numpy as np
+import os, sys
 
 from process_acs import *
 from process_decennial import *
 from sample_data import *
 
-import pyomo.environ
-from pyomo.core import *
-from pyomo.opt import SolverFactory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from projection import *
+from ingest import read_csv_files
+from noise import keyed_laplace, cell_keys, geo_keys
+from ecdf import ECDF
 
 import matplotlib.pyplot as plt
 
-def read_dir(race):
+# columns written by sample_single_year_age_distribution.main
+synthetic_pop_dtypes = {'state':'int8', 'county':'int16', 'tract':'int32', 'blkgrp':'int16',
+                        'sex_id':'int8', 'age':'int16', 'pop_count':'int32'}
+
+def read_dir(race, max_workers = None):
     in_dir = '/home/j/temp/beatrixh/sim_science/outputs/WA_synthetic_pop_distribution/'
     files = os.listdir(in_dir + race)
     
-    df = pd.DataFrame()
-    for file in files:
-        sub_df = pd.read_csv(in_dir + race + '/' + file)
-        df = df.append(sub_df)
-    return df
+    return read_csv_files([in_dir + race + '/' + file for file in files],
+                          dtype = synthetic_pop_dtypes, max_workers = max_workers, use_cache = False)
+
+# single-year age 0 ... 120 -> age group start, for each aggregation scheme
+single_year_ages = np.arange(0,121)
+age_maps = {'a1': np.where(single_year_ages < 85, single_year_ages,
+                           np.where(single_year_ages < 100, single_year_ages - single_year_ages%5, 100)),
+            'a2': np.where(single_year_ages < 90, single_year_ages,
+                           np.where(single_year_ages < 100, single_year_ages - single_year_ages%5, 100)),
+            'a3': np.minimum(single_year_ages, 90)}
 
 def aggregate_by_age(input_df, count_var, how = 'a1'):
-      
-    # copy input df
-    df = input_df.copy(deep=True)
+    """ sum count_var by geoid, race, sex_id and how's age groups;
+        rows come out in order of first appearance, with columns geoid, race, sex_id, <how>_start, <how>_total
+    """
+    return aggregate_by_age_all(input_df, count_var, hows = [how])[how]
 
-    # create age map 
-    age_map = pd.DataFrame(data = np.arange(0,121), columns=['age'])
+def aggregate_by_age_all(input_df, count_var, hows = ('a1','a2','a3'), group_cols = ('geoid','race','sex_id')):
+    """ aggregate_by_age for several schemes, sharing one pass over the group columns
     
-    # create age_start col
-    if how=='a1':
-        age_map['a1_start'] = [i if i < 85 else (i - i%5) if i < 100 else 100 for i in age_map.age]
-    elif how=='a2':
-        age_map['a2_start'] = [i if i < 90 else (i- i%5) if i < 100 else 100 for i in age_map.age]
-    elif how=='a3':
-        age_map['a3_start'] = [i if i < 90 else 90 for i in age_map.age]
-
-    # merge on age 
-    df.age = df.age.astype(int)
-    df = df.merge(age_map, on='age', how = 'left')
+    Each group column is factorized once into integer codes and combined into one int64 key;
+    each scheme then maps age through its age_maps array and sums with one bincount.
     
-    # sum total counts by age groups
-    a_total = how + '_total'
-    a_start = how + '_start'
-    df[a_total] = df.groupby([a_start, 'geoid', 'sex_id','race'])[count_var].transform('sum')
+    Results
+    -------
+    returns dict how -> df like aggregate_by_age's output
+    """
+    for how in hows:
+        if how not in age_maps:
+            raise Exception("oops; how must be in " + str(list(age_maps)))
+    group_cols = list(group_cols)
     
-    # return df subset by new age groups
-    return df[['geoid','race','sex_id',a_start,a_total]].drop_duplicates()
+    age = input_df['age'].to_numpy().astype(np.int64)
+    if len(age) and (age.min() < 0 or age.max() > 120):
+        raise Exception("oops; ages must be in 0 ... 120")
+    counts = input_df[count_var].to_numpy()
+    
+    # mixed-radix int64 key over the group columns' codes; rows with a missing group value drop out, as in groupby
+    key = np.zeros(len(input_df), dtype=np.int64)
+    keep = np.ones(len(input_df), dtype=bool)
+    uniques, radices = [], []
+    for col in group_cols:
+        codes, vals = pd.factorize(input_df[col])
+        keep &= codes >= 0
+        key = key * len(vals) + codes
+        uniques.append(vals)
+        radices.append(len(vals))
+    
+    out = {}
+    for how in hows:
+        cell_codes, cells = pd.factorize(key[keep] * 121 + age_maps[how][age[keep]])
+        totals = np.bincount(cell_codes, weights=counts[keep], minlength=len(cells))
+        if counts.dtype.kind in 'biu':
+            totals = totals.astype(counts.dtype)
+        
+        # decode the cell keys back into column values
+        group_key, a_start = np.divmod(cells, 121)
+        cols = {}
+        for col, vals, radix in zip(group_cols[::-1], uniques[::-1], radices[::-1]):
+            group_key, code = np.divmod(group_key, radix)
+            cols[col] = vals.take(code)
+        df = pd.DataFrame({col: cols[col] for col in group_cols})
+        df[how + '_start'] = a_start
+        df[how + '_total'] = totals
+        out[how] = df
+    return out
 
-def das(input_df, counts_var, noise_parameter):
+def das(input_df, counts_var, noise_parameter, backend='numpy', run_seed=None, geo_col='geoid', key_cols=None):
     """ takes in dataframe with a column, 'pop_count', with actual counts
         outputs dataframe with new columns for noisy and nonneg counts
+        backend is passed through to post_proc
+        
+        with run_seed set, each row's noise is keyed by (run_seed, geo_col, key_cols) (see noise),
+        so it doesn't depend on row order or chunking; key_cols defaults to every column
+        other than geo_col and counts_var. Otherwise noise comes from the global np.random state
     """
     df = input_df.copy(deep=True)
     
     n = df.shape[0]
     
     # add laplace noise 
-    noise = np.random.laplace(loc=0, scale=noise_parameter, size=n)
+    if run_seed is None:
+        noise = np.random.laplace(loc=0, scale=noise_parameter, size=n)
+    else:
+        if key_cols is None:
+            key_cols = [i for i in df.columns if i not in (geo_col, counts_var)]
+        noise = keyed_laplace(noise_parameter, run_seed, geo_keys(df[geo_col]), cell_keys(df, key_cols))
     df['noisy_counts'] = df[counts_var] + noise
     
     # post processing
-    df['nonneg_counts'] = post_proc(df.noisy_counts, df.pop_count.sum())
+    df['nonneg_counts'] = post_proc(df.noisy_counts, df.pop_count.sum(), backend=backend)
     df.nonneg_counts = np.round(df.nonneg_counts)
     
     return df
 
-def post_proc(noisy_counts, control_total):
+def post_proc(noisy_counts, control_total, backend='numpy'):
     """optimize the noisy counts so that they sum to
     the control total and are non-negative
     
@@ -74,34 +124,25 @@ def post_proc(noisy_counts, control_total):
     ----------
     noisy_counts : list-like of floats
     control_total : float
+    backend : 'numpy' for the exact simplex projection,
+              'ipopt' to solve with pyomo/ipopt for cross-checking
     
     Results
     -------
     returns optimized_counts, which are close to noisy counts,
     but not negative, and match control total in aggregate
     """
-    noisy_counts = list(noisy_counts)
-    
-    model = ConcreteModel()
-    model.I = range(len(noisy_counts))
-    model.x = Var(model.I, within=NonNegativeReals)
-    model.objective = Objective(
-        expr=sum((model.x[i] - noisy_counts[i])**2 for i in model.I))
-    model.constraint = Constraint(
-        expr=summation(model.x) == control_total)
-    
-    solver = SolverFactory('ipopt')
-    results = solver.solve(model, options={'acceptable_tol':1e-4}, tee=False)
-    optimized_counts = [value(model.x[i]) for i in model.I]
-        
-    return np.array(optimized_counts)
+    return nonneg_project(noisy_counts, control_total, backend=backend)
 
 def count_pop_leq(df, var, x):
-    return df[df[var] <= x].shape[0]
+    """ number of rows with var <= x; x may be an array of cutoffs, answered from one sort
+        (for repeated queries on the same df, build an ecdf.ECDF once and reuse it)
+    """
+    return ECDF(df, var).count_leq(x)
 
 def plot_small_vals(df, var = 'pop_count', label = 'pop_count', cutoffs = 1.2**np.arange(35)):
     leq_df = pd.DataFrame(columns = ['x'], data = cutoffs)
-    leq_df['fx'] = [count_pop_leq(df, var, i) for i in leq_df.x]
+    leq_df['fx'] = count_pop_leq(df, var, leq_df.x.to_numpy())
     
     plt.scatter(x = leq_df.x, y = leq_df.fx, label = label)
     
@@ -8,7 +8,10 @@ a df in long format, with, for each [sex] x [single-year-age] x [state] x [year]
 the location
 """
 
-import pandas as pd, numpy as np, os
+import pandas as pd, numpy as np, os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ingest import read_csv_files
 
 # def load_data(personurl, year):
 #     year = year
@@ -19,7 +22,14 @@ import pandas as pd, numpy as np, os
 #                 "racnh","racpi","racsor","racwht","hisp"]
 #     return df.filter(items=df_cols)
 
-def load_data(state, years = np.arange(1996,2013).tolist() + [2017]):
+# PUMS person columns we use, and the compact dtypes they're parsed with
+acs_cols = ["serialno", "st", "year", "pwgtp", "agep", "sex","racnum","racaian","racasn","racblk",
+            "racnh","racpi","racsor","racwht","hisp"]
+acs_dtypes = {"serialno": str, "st": "int8", "year": "int16", "pwgtp": "int32", "agep": "int16",
+              "sex": "int8", "racnum": "int8", "racaian": "int8", "racasn": "int8", "racblk": "int8",
+              "racnh": "int8", "racpi": "int8", "racsor": "int8", "racwht": "int8", "hisp": "int8"}
+
+def load_data(state, years = np.arange(1996,2013).tolist() + [2017], use_cache = True, max_workers = None):
     assert(len(state)==2), "state must be 2-char abbreviation"
     state = state.upper()
     
@@ -32,20 +42,14 @@ def load_data(state, years = np.arange(1996,2013).tolist() + [2017]):
     for year in years:
         assert(year in np.arange(1996,2013).tolist() + [2017]), "years must be from 1996-2012 or 2017; else use load_incoming_data()"
     
-    df = pd.DataFrame()
-    for year in years:
-        IN_DIR = "/home/j/DATA/USA/AMERICAN_COMMUNITY_SURVEY/"
-        personurl = 'USA_ACS_' + str(year) + '_PERSONS_' + str(state) + '_Y2012M02D01.CSV'
-        path = IN_DIR + str(year) + '/' + personurl
-        if os.path.isfile(path):
-            new_df = pd.read_csv(path) 
-            new_df["year"] = str(year)   
-            new_df.columns = new_df.columns.map(str.lower)
-            df = df.append(new_df)
+    IN_DIR = "/home/j/DATA/USA/AMERICAN_COMMUNITY_SURVEY/"
+    paths = {year: IN_DIR + str(year) + '/' + 'USA_ACS_' + str(year) + '_PERSONS_' + str(state) + '_Y2012M02D01.CSV'
+             for year in years}
+    paths = {year: path for year, path in paths.items() if os.path.isfile(path)}
+    
+    df = read_acs_files(paths, state, use_cache = use_cache, max_workers = max_workers)
     df["st"] = state
-    df_cols = ["serialno", "st", "year", "pwgtp", "agep", "sex","racnum","racaian","racasn","racblk",
-                "racnh","racpi","racsor","racwht","hisp"]
-    return df.filter(items=df_cols)
+    return df
     
 # def load_incoming_data(personurl, year):
 #     year = year
@@ -57,7 +61,7 @@ def load_data(state, years = np.arange(1996,2013).tolist() + [2017]):
 #                 "racnh","racpi","racsor","racwht","hisp"]
 #     return df.filter(items=df_cols)
 
-def load_incoming_data(state, years = np.arange(2012,2017).tolist()):
+def load_incoming_data(state, years = np.arange(2012,2017).tolist(), use_cache = True, max_workers = None):
     assert(len(state)==2), "state must be 2-char abbreviation"
     state = state.lower()
     
@@ -70,155 +74,117 @@ def load_incoming_data(state, years = np.arange(2012,2017).tolist()):
     for year in years:
         assert(year in np.arange(2012,2017)), "years must be from 2012-2016; else use load_data()"
     
-    df = pd.DataFrame()
-    for year in years:
-        IN_DIR = "/home/j/DATA/Incoming Data/USA/AMERICAN_COMMUNITY_SURVEY"
-        personurl = 'ss' + str(year)[2:] + 'p' + state + '.csv'
-        
-        new_df = pd.read_csv(IN_DIR + '/' + str(year) + '/' + "data/" + personurl)
-        new_df["year"] = str(year)
-        new_df.columns = new_df.columns.map(str.lower)
-        df = df.append(new_df)
-    df_cols = ["serialno", "st","year", "pwgtp", "agep", "sex","racnum","racaian","racasn","racblk",
-                    "racnh","racpi","racsor","racwht","hisp"]
-    return df.filter(items=df_cols)
+    IN_DIR = "/home/j/DATA/Incoming Data/USA/AMERICAN_COMMUNITY_SURVEY"
+    paths = {year: IN_DIR + '/' + str(year) + '/' + "data/" + 'ss' + str(year)[2:] + 'p' + state + '.csv'
+             for year in years}
+    
+    return read_acs_files(paths, state, use_cache = use_cache, max_workers = max_workers)
+
+def read_acs_files(paths, state, use_cache = True, max_workers = None):
+    """ read {year: path} PUMS person files concurrently, restricted to acs_cols
+        and parsed with acs_dtypes, adding a year col; concatenates once
+    """
+    years = list(paths.keys())
+    return read_csv_files([paths[year] for year in years], usecols = acs_cols, dtype = acs_dtypes,
+                          assign = [{"year": year} for year in years], lowercase = True,
+                          max_workers = max_workers, use_cache = use_cache,
+                          partition_values = [{'state':state.upper(), 'year':year} for year in years])
+
+# bit i of a race_code is set when a person reports acs_races[i]
+acs_races = ['racaian', 'racasn', 'racblk', 'racnhpi', 'racsor', 'racwht']
+race_count_lookup = np.array([bin(i).count('1') for i in range(64)], dtype='int8')
+
+# hisp: 1 = not hispanic, 2-24 = hispanic origin groups
+hispanic_lookup = np.full(25, -1, dtype='int8')
+hispanic_lookup[1] = 0
+hispanic_lookup[2:] = 1
+
+state_lookup = np.full(73, None, dtype=object)
+for fips, abbr in {1: "AL", 2: "AK", 4: "AR", 5: "AZ", 6: "CA", 8: "CO", 9: "CT", 10: "DE", 11: "DC",
+                   12: "FL", 13: "GA", 15: "HI", 16: "ID", 17: "IL", 18: "IN", 19: "IA", 20: "KS",
+                   21: "KY", 22: "LA", 23: "ME", 24: "MD", 25: "MA", 26: "MI", 27: "MN", 28: "MS",
+                   29: "MO", 30: "MT", 31: "NE", 32: "NV", 33: "NH", 34: "NJ", 35: "NM", 36: "NY",
+                   37: "NC", 38: "ND", 39: "OH", 40: "OK", 41: "OR", 42: "PA", 44: "RI", 45: "SC",
+                   46: "SD", 47: "TN", 48: "TX", 49: "UT", 50: "VT", 51: "VA", 53: "WA", 54: "WV",
+                   55: "WI", 56: "WY", 72: "PR"}.items():
+    state_lookup[fips] = abbr
+
+def race_code(races):
+    """ 6-bit race_code for a list of acs race vars, e.g. ['racblk','racwht'] -> 36
+    """
+    if type(races)!=list:
+        races = [races]
+    return int(sum(1 << acs_races.index(i) for i in races))
 
 def format_acs(input_df, races, years, incl_hispanic = False):
     """input: raw ACS data for a state & year(s)
        output: df with counts of people (using person weights) per state/sex/age/ethnicity/race bin, averaged over all years (each year 
                weighted equally)
+       one race combination; see format_acs_all to get every combination from one pass
     """
-    #create copy of df
-    df = input_df.copy(deep=True)
-    
-    #combine native hawaiian and pacific islander
-    df['racnhpi'] = df[['racnh','racpi']].max(axis=1)
-    df.drop(columns=['racnh','racpi'], inplace=True)
-    
-    #TEST sum of races == racnum
-    all_races = ['racaian', 'racasn', 'racblk', 'racnhpi', 'racsor', 'racwht']
-    df['race_count'] = df[all_races].sum(axis=1)
-    assert(df[df.race_count!=df.racnum].shape[0]==0), "races in each row dont' sum to row total"
-#     assert(type(races)==list), "Oops; even if only one race, type(races) needs to be list"
+    df = format_acs_all(input_df, incl_hispanic = incl_hispanic)
+    df = df[df.race_code==race_code(races)].drop(columns=['race_code'])
     
-    #subset to races of interest
-    if type(races)!=list:
-        races = [races]
-    df = df[df.race_count==len(races)]
+    #TEST: people exist in this category
     
+    return df.sort_values(df.columns.tolist())
+
+def format_acs_all(input_df, incl_hispanic = False):
+    """input: raw ACS data for a state & year(s)
+       output: the format_acs table for every race combination at once, with a race_code col
+               (bit i set <=> acs_races[i]); weighted counts come from one groupby().sum()
+    """
+    flag = lambda col: input_df[col].to_numpy() > 0
     
-    for i in races:
-        df = df[df[i] > 0]
+    #encode race flags, combining native hawaiian and pacific islander
+    code = (flag('racaian').astype('int8')
+            | flag('racasn') << 1
+            | flag('racblk') << 2
+            | (flag('racnh') | flag('racpi')) << 3
+            | flag('racsor') << 4
+            | flag('racwht') << 5).astype('int8')
     
-    #TEST: people exist in this category
+    #TEST sum of races == racnum
+    race_count = race_count_lookup[code]
+    assert((race_count!=input_df.racnum.to_numpy()).sum()==0), "races in each row dont' sum to row total"
     
     #remap vars
-    df["hispanic"] = df['hisp'].map({1: 0,
-                                     2: 1,
-                                     3: 1,
-                                     4: 1,
-                                     5: 1,
-                                     6: 1,
-                                     7: 1,
-                                     8: 1,
-                                     9: 1,
-                                     10: 1,
-                                     11: 1,
-                                     12: 1,
-                                     13: 1,
-                                     14: 1,
-                                     15: 1,
-                                     16: 1,
-                                     17: 1,
-                                     18: 1,
-                                     19: 1,
-                                     20: 1,
-                                     21: 1,
-                                     22: 1,
-                                     23: 1,
-                                     24: 1})
-    
-    df["state"] = df["st"].map({1: "AL",
-                             2: "AK",
-                             4: "AR",
-                             5: "AZ",
-                             6: "CA",
-                             8: "CO",
-                             9: "CT",
-                             10: "DE",
-                             11: "DC",
-                             12: "FL",
-                             13: "GA",
-                             15: "HI",
-                             16: "ID",
-                             17: "IL",
-                             18: "IN",
-                             19: "IA",
-                             20: "KS",
-                             21: "KY",
-                             22: "LA",
-                             23: "ME",
-                             24: "MD",
-                             25: "MA",
-                             26: "MI",
-                             27: "MN",
-                             28: "MS",
-                             29: "MO",
-                             30: "MT",
-                             31: "NE",
-                             32: "NV",
-                             33: "NH",
-                             34: "NJ",
-                             35: "NM",
-                             36: "NY",
-                             37: "NC",
-                             38: "ND",
-                             39: "OH",
-                             40: "OK",
-                             41: "OR",
-                             42: "PA",
-                             44: "RI",
-                             45: "SC",
-                             46: "SD",
-                             47: "TN",
-                             48: "TX",
-                             49: "UT",
-                             50: "VT",
-                             51: "VA",
-                             53: "WA",
-                             54: "WV",
-                             55: "WI",
-                             56: "WY",
-                             72: "PR"})
-    
-    df.rename(columns={"agep": "age",
-                       "pwgtp": "weight",
-                       "sex": "sex_id"
-                      }, inplace=True)
-    df.drop(["hisp","st","racnum"], axis=1, inplace=True)
-    
-    #weight population distr. from each year equally
-    df["pop_year_weight"] = df.groupby('year')['weight'].transform('sum') / df.weight.sum()
-    df["weight"] = df.weight * df.pop_year_weight
-    df.drop(columns=['pop_year_weight'], inplace=True)
-    
-    #drop hispanic, get population counts per race/ethnicity/sex/age
-    if not incl_hispanic:
-        df.drop(columns=['hispanic'], inplace=True) 
-        df['pop_count'] = df.groupby(all_races + ['sex_id','age'])['weight'].transform('sum')
-        df.drop(columns=['weight','serialno','year'], inplace=True)
-        df.drop_duplicates(inplace=True)
-        df = df[['state','sex_id','age'] + all_races + ['race_count','pop_count']]
-    else:
-        df['pop_count'] = df.groupby(all_races + ['hispanic','sex_id','age'])['weight'].transform('sum')
-        df.drop(columns=['weight','serialno','year'], inplace=True)
-        df.drop_duplicates(inplace=True)
-        df = df[['state','sex_id','age','hispanic'] + all_races + ['race_count','pop_count']]
-    
+    st = input_df.st.to_numpy()
+    state = state_lookup[st.astype('int64')] if st.dtype.kind in 'iu' else st
+    
+    df = pd.DataFrame({'state': state,
+                       'race_code': code,
+                       'sex_id': input_df.sex.to_numpy(),
+                       'age': input_df.agep.to_numpy(),
+                       'year': input_df.year.to_numpy(),
+                       'weight': input_df.pwgtp.to_numpy(dtype=float)})
+    keys = ['state','race_code','sex_id','age']
+    if incl_hispanic:
+        df['hispanic'] = hispanic_lookup[input_df.hisp.to_numpy().astype('int64')]
+        keys = ['state','race_code','hispanic','sex_id','age']
+    df = df[df.race_code > 0]
+    
+    #weight population distr. from each year equally, within each race combination;
+    #the (race, year) and race totals are one bincount each, gathered back onto the rows
+    code = df.race_code.to_numpy().astype('int64')
+    year_code, years = pd.factorize(df.year)
+    race_year = code * len(years) + year_code
+    weight = df.weight.to_numpy()
+    year_total = np.bincount(race_year, weights=weight, minlength=64 * len(years))[race_year]
+    race_total = np.bincount(code, weights=weight, minlength=64)[code]
+    df['weight'] = weight * year_total / race_total
+    
+    #get population counts per race/ethnicity/sex/age
+    df = df.groupby(keys)['weight'].sum().reset_index(name='pop_count')
+    
+    #decode race flags
+    for i, race in enumerate(acs_races):
+        df[race] = ((df.race_code.to_numpy() >> i) & 1).astype('int64')
+    df['race_count'] = race_count_lookup[df.race_code.to_numpy()].astype('int64')
     df['pop_count'] = np.round(df.pop_count)
-    df = df.sort_values(df.columns.tolist())
     
-    return df
+    cols = ['state','sex_id','age'] + (['hispanic'] if incl_hispanic else []) + acs_races + ['race_count','pop_count','race_code']
+    return df[cols]
 
 def add_decennial_age_bins(input_df, incl_hispanic = False):
     ''' merge on age groups and calculate proportion of age group each age comprises
@@ -1,4 +1,9 @@
 import pandas as pd, numpy as np
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parquet_cache import cached_read_csv, cached_read_csv_chunks
+from geocodes import pack_geoid, key_to_geoid
 
 input_dir = '/home/j/temp/beatrixh/sim_science/decennial_census_2010/'
 location_cols = ['STATE', 'COUNTY', 'TRACT', 'BLKGRP', 'BLOCK']
@@ -14,10 +19,66 @@ sex_by_age_nhpi_alone = ['P012E00' + str(i) if i<10 else 'P012E0' + str(i) for i
 sex_by_age_otherrace_alone = ['P012F00' + str(i) if i<10 else 'P012F0' + str(i) for i in range(1,50)]
 sex_by_age_mixed_race = ['P012G00' + str(i) if i<10 else 'P012G0' + str(i) for i in range(1,50)]
 
+# start of each decennial sex-by-age bin; the last one runs 85-120
+decennial_age_starts = [0,5,10,15,18,20,21,22,25,30,35,40,45,50,55,60,62,65,67,70,75,80,85]
+
+# compact parse dtypes; geography cols are NaN on non-block summary rows, so float until filtered
+location_dtypes = {'STATE':'float32', 'COUNTY':'float32', 'TRACT':'float32', 'BLKGRP':'float32', 'BLOCK':'float32'}
+    
+def read_decennial(race_specific_sex_by_age, path = 'WA2010DHCCSV/WA2010DHC.CSV', chunksize = None, out_path = None,
+                   use_cache = True):
+    """ read block-level sex-by-age counts for one race table, in long format
     
-def read_decennial(race_specific_sex_by_age, path = 'WA2010DHCCSV/WA2010DHC.CSV'):
-    df = pd.read_csv(input_dir + path, usecols = location_cols + race_specific_sex_by_age)
-    df = df[df.BLOCK.notna()]
+    Parameters
+    ----------
+    race_specific_sex_by_age : list of census var names, e.g. sex_by_age_white_alone
+    path : path relative to input_dir
+    chunksize : if set, parse and process the csv this many rows at a time,
+                so peak memory is bounded by the chunk rather than the file
+    out_path : if set, append each processed chunk to this csv and return the path
+    use_cache : read through the parquet cache (partitioned by STATE); see parquet_cache
+    
+    Results
+    -------
+    returns df with geoid/sex_id/age_start/age_end/pop_count, or out_path
+    """
+    if chunksize is None and out_path is None:
+        df = cached_read_csv(input_dir + path, usecols = location_cols + race_specific_sex_by_age,
+                             dtype = _decennial_dtypes(race_specific_sex_by_age), partition_cols = ['STATE'],
+                             filters = [('BLOCK', '>=', 0)], chunksize = 1_000_000, use_cache = use_cache)
+        return _process_decennial_chunk(df, race_specific_sex_by_age)
+    
+    chunks = read_decennial_chunks(race_specific_sex_by_age, path, chunksize = chunksize or 100_000, use_cache = use_cache)
+    if out_path is None:
+        return pd.concat(chunks, ignore_index=True)
+    
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    for chunk in chunks:
+        chunk.to_csv(out_path, mode='a', header=not os.path.exists(out_path), index=False)
+    return out_path
+
+def read_decennial_chunks(race_specific_sex_by_age, path = 'WA2010DHCCSV/WA2010DHC.CSV', chunksize = 100_000,
+                          use_cache = True, keep_table = False, geoid_strings = True):
+    """ generator over processed block-level chunks of a decennial csv;
+    each chunk is filtered, melted and age-mapped on its own
+    
+    keep_table adds a 'table' col with the race table letter (A-G), for reading several race
+    tables in one pass; geoid_strings=False skips the string geoid and keeps only geokey
+    """
+    reader = cached_read_csv_chunks(input_dir + path, usecols = location_cols + race_specific_sex_by_age,
+                                    dtype = _decennial_dtypes(race_specific_sex_by_age), partition_cols = ['STATE'],
+                                    filters = [('BLOCK', '>=', 0)], chunksize = chunksize, use_cache = use_cache)
+    for df in reader:
+        df = df[df.BLOCK.notna()]
+        if df.shape[0] > 0:
+            yield _process_decennial_chunk(df, race_specific_sex_by_age, keep_table, geoid_strings)
+
+def _decennial_dtypes(race_specific_sex_by_age):
+    return dict(location_dtypes, **{i:'float32' for i in race_specific_sex_by_age})
+
+def _process_decennial_chunk(df, race_specific_sex_by_age, keep_table = False, geoid_strings = True):
+    df = df[df.BLOCK.notna()].astype({i:'int64' for i in location_cols})
     
     #cast race vars to long format
     df = df.melt(id_vars = location_cols, value_vars = race_specific_sex_by_age)
@@ -29,36 +90,26 @@ def read_decennial(race_specific_sex_by_age, path = 'WA2010DHCCSV/WA2010DHC.CSV'
     
     # cleaning
     df = rename_census_ages(df)
-    df = add_geoid(df)
+    df = add_geoid(df, as_string = geoid_strings)
     df = df[~df.variable.str[-2:].isin(['02','26'])] #combine this with prev step if rewrite rename_census_ages
+    if keep_table:
+        df['table'] = df.variable.str[4].astype('category')
     
     df.drop(columns=location_cols + ['var_key','variable'], inplace=True)
     df.rename(columns={'value':'pop_count'}, inplace=True)
+    df['pop_count'] = df.pop_count.astype('int32')
     
     return df
     
-def add_geoid(input_df):
-    """ input shape: has ['STATE','COUNTY','TRACT','BLOCK'] with dtypes [int,float,float,float]
-        rewrite this for states/tracts/counties with different str(int(x)) lengths
+def add_geoid(input_df, as_string = True):
+    """ input shape: has ['STATE','COUNTY','TRACT','BLOCK'] as ints (or NaN-free floats), any state
+        adds 'geokey', the int64 block key from geocodes.pack_geoid, to join/group on,
+        and, if as_string, the 15-char 'geoid' string
     """
     df = input_df.copy(deep=True)
-    df['COUNTY'] = df.COUNTY.astype(int).astype(str)
-    df['COUNTY'] = ['00' + i for i in df.COUNTY]
-    df['COUNTY'] = df.COUNTY.str[-3:]
-
-    df['TRACT'] = df.COUNTY.astype(int).astype(str)
-    df['TRACT'] = ['00000' + i for i in df.COUNTY]
-    df['TRACT'] = df.TRACT.str[-6:]
-
-    df['BLKGRP'] = df.COUNTY.astype(int).astype(str)
-
-    df['BLOCK'] = df.COUNTY.astype(int).astype(str)
-    df['BLOCK'] = ['000' + i for i in df.COUNTY]
-    df['BLOCK'] = df.BLOCK.str[-4:]
-
-    df['geoid'] = df.STATE.astype(str) + df.COUNTY.astype(str) + df.TRACT.astype(str) + df.BLOCK.astype(str)
-    
-    #test len(i) for i in df.geoid == 15
+    df['geokey'] = pack_geoid(df.STATE, df.COUNTY, df.TRACT, df.BLOCK)
+    if as_string:
+        df['geoid'] = key_to_geoid(df.geokey)
     
     return df
 
@@ -74,7 +125,7 @@ def rename_census_ages(input_df):
     
     
     # map census var names into something readable
-    age_start = [0,5,10,15,18,20,21,22,25,30,35,40,45,50,55,60,62,65,67,70,75,80,85]
+    age_start = list(decennial_age_starts)
     age_end = [i-1 for i in age_start[1:]] + [120]
 
     age_start = [0] + age_start
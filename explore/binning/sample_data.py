@@ -1,44 +1,55 @@
 import pandas as pd, numpy as np
 
-def generate_single_year_df(input_df, age_distribution):
+def generate_single_year_df(input_df, age_distribution, rng=None):
     ''' takes in a df with geoid/sex_id/age-bins
         outputs df with geoid/sex_id/single-year-ages
+        
+        all rows sharing a (sex_id, age_start) bin are sampled with one multinomial call,
+        and counts are scattered into a geoid x sex x age integer array
     '''
+    rng = np.random.default_rng(rng)
+    if not isinstance(age_distribution, AgeLookup):
+        age_distribution = AgeLookup(age_distribution)
+    
     # subset to rows of interest / rows with positive population
     input_df = input_df[input_df.pop_count>0]
     
-    # initialize output df with pop_counts == 0
-    df = input_df[['geoid','sex_id']].drop_duplicates()
-    
-    for i in np.arange(121):
-        var = str(i)
-        df[var] = 0
-
-    df = df.melt(id_vars = ['geoid','sex_id'],
-                 value_vars = [str(i) for i in np.arange(121)],
-                 var_name='age', value_name = 'pop_count')
-
-    df.age = df.age.astype('int64')
+    geo_code, geoids = pd.factorize(input_df.geoid)
+    sex_id = input_df.sex_id.to_numpy().astype('int64')
+    pop_count = input_df.pop_count.to_numpy().astype('int64')
     
     # fill pop_count
-    for i, row in input_df.iterrows():
-        geoid = row.geoid
-        sex_id = row.sex_id
-        single_years = sample_data(row, age_distribution)
-        for i in single_years:
-            df.loc[(df.age==i) & (df.sex_id==sex_id) & (df.geoid==geoid),'pop_count'] +=1
+    counts = np.zeros((len(geoids), 2, 121), dtype='int64')
+    for (sex, age_bin), idx in input_df.groupby(['sex_id','age_start']).indices.items():
+        vals, probs = age_distribution.distribution(sex, age_bin)
+        draws = rng.multinomial(pop_count[idx], probs)
+        np.add.at(counts, (geo_code[idx][:,None], sex - 1, vals[None,:]), draws)
     
-    # test
-#     assert(input_df.pop_count.sum()==df.pop_count.sum()), 'Total population mismatch'
+    # one row per age for every geoid/sex_id present in the input
+    pairs = np.unique(np.stack([geo_code, sex_id], axis=1), axis=0)
+    g = np.tile(pairs[:,0], 121)
+    s = np.tile(pairs[:,1], 121)
+    age = np.repeat(np.arange(121), len(pairs))
+    df = pd.DataFrame({'geoid': geoids.to_numpy()[g],
+                       'sex_id': s,
+                       'age': age,
+                       'pop_count': counts[g, s - 1, age]})
     
+    # test
+    assert(input_df.pop_count.sum()==df.pop_count.sum()), 'Total population mismatch'
     assert(input_df.geoid.nunique()==df.geoid.nunique()), 'Geoid mismatch'
     
     return df
 
-def sample_data(row, age_distribution):
+def sample_data(row, age_distribution, rng=None):
     ''' for each row of data, corresponding to a specific sex/race/ethnicity/age-bin:
         generate single-year age samples from ACS age distribution
+        
+        age_distribution can be the add_decennial_age_bins df, or an AgeLookup built from it
     '''
+    if isinstance(age_distribution, AgeLookup):
+        return age_distribution.sample(row.sex_id, row.age_start, row.pop_count, rng=rng)
+    
     #get specific vals
     size = row.pop_count
     sex = row.sex_id
@@ -51,5 +62,69 @@ def sample_data(row, age_distribution):
     # draw random specific ages
     return np.random.choice(a=vals, p=probs, size = size)
 
-
-    
\ No newline at end of file
+class AgeLookup(object):
+    ''' dense sex x age-bin x single-age table of ACS age probabilities,
+        built once from the add_decennial_age_bins output
+        
+        probs[sex_id - 1, bin, age] is the share of the bin at that single age and
+        cdf holds its running sum for inverse-CDF sampling, so drawing ages for a row
+        is a searchsorted over 121 values instead of filtering a DataFrame.
+        plain numpy arrays only, so it pickles cheaply to worker processes
+    '''
+    __slots__ = ['age_starts', 'bin_index', 'probs', 'cdf']
+    
+    def __init__(self, age_distribution, weight_col = 'pop_proportion', age_starts = None):
+        df = age_distribution[['sex_id','age_start','age',weight_col]]
+        if not df.sex_id.isin([1,2]).all():
+            raise Exception("Oops; sex_id must be 1 or 2")
+        
+        if age_starts is None:
+            age_starts = df.age_start.unique()
+        self.age_starts = np.sort(np.asarray(age_starts)).astype('int64')
+        if not df.age_start.isin(self.age_starts).all():
+            raise Exception("Oops; age_distribution has age_start vals not in age_starts")
+        self.bin_index = np.full(121, -1, dtype='int64')
+        self.bin_index[self.age_starts] = np.arange(len(self.age_starts))
+        
+        weights = np.zeros((2, len(self.age_starts), 121))
+        np.add.at(weights, (df.sex_id.to_numpy().astype('int64') - 1,
+                            self.bin_index[df.age_start.to_numpy().astype('int64')],
+                            df.age.to_numpy().astype('int64')),
+                  df[weight_col].to_numpy(dtype=float))
+        
+        # normalize within each sex/bin; bins with no ACS people stay all-zero
+        totals = weights.sum(axis=2, keepdims=True)
+        self.probs = np.divide(weights, totals, out=np.zeros_like(weights), where=totals>0)
+        self.cdf = np.cumsum(self.probs, axis=2)
+        self.cdf[..., -1] = np.where(totals[..., 0]>0, 1., 0.)
+    
+    def fill_empty_bins(self, other):
+        ''' copy other's distribution into every sex/bin that has no ACS people here,
+            e.g. to fall back on the all-races distribution for a small race group
+        '''
+        if not np.array_equal(self.age_starts, other.age_starts):
+            raise Exception("Oops; lookups have different age bins")
+        empty = self.cdf[..., -1]==0
+        self.probs[empty] = other.probs[empty]
+        self.cdf[empty] = other.cdf[empty]
+        return self
+    
+    def _index(self, sex, age_start):
+        b = self.bin_index[int(age_start)] if 0 <= int(age_start) < 121 else -1
+        if int(sex) not in [1,2] or b < 0 or self.cdf[int(sex) - 1, b, -1]==0:
+            raise Exception("Oops; no ACS ages for sex_id " + str(sex) + ", age_start " + str(age_start))
+        return int(sex) - 1, b
+    
+    def distribution(self, sex, age_start):
+        ''' single-year ages with positive probability in a sex/age-bin, and their probabilities
+        '''
+        s, b = self._index(sex, age_start)
+        ages = np.flatnonzero(self.probs[s, b])
+        return ages, self.probs[s, b, ages]
+    
+    def sample(self, sex, age_start, size, rng=None):
+        ''' draw size single-year ages for a sex/age-bin by inverse CDF
+        '''
+        s, b = self._index(sex, age_start)
+        rng = np.random.default_rng(rng)
+        return np.searchsorted(self.cdf[s, b], rng.random(int(size)), side='right')
@@ -4,6 +4,9 @@ from process_acs import *
 from process_decennial import *
 from sample_data import *
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import instrument
+
 def main(state, races, start, stop, decennial_path = 'WA2010DHCCSV/WA2010DHC.CSV'):
     races = races.split(sep=',')
     decennial_races_dict = {'racaian':sex_by_age_aian_alone,
@@ -20,35 +23,53 @@ def main(state, races, start, stop, decennial_path = 'WA2010DHCCSV/WA2010DHC.CSV
         decennial_races_var = decennial_races_dict[races[0]]
 
     # get age distribution from ACS
-    age_distribution = load_incoming_data(state)
-    age_distribution = format_acs(age_distribution, races = races, years = age_distribution.year.unique().tolist())
-    age_distribution = add_decennial_age_bins(age_distribution)
+    with instrument.stage('load_incoming_data') as s:
+        age_distribution = load_incoming_data(state)
+        s['rows_out'] = len(age_distribution)
+    with instrument.stage('format_acs', rows_in = len(age_distribution)) as s:
+        age_distribution = format_acs(age_distribution, races = races, years = age_distribution.year.unique().tolist())
+        s['rows_out'] = len(age_distribution)
+    with instrument.stage('add_decennial_age_bins', rows_in = len(age_distribution)) as s:
+        age_distribution = add_decennial_age_bins(age_distribution)
+        s['rows_out'] = len(age_distribution)
     
-    decennial = read_decennial(race_specific_sex_by_age = decennial_races_var, path = decennial_path)
+    with instrument.stage('read_decennial') as s:
+        decennial = read_decennial(race_specific_sex_by_age = decennial_races_var, path = decennial_path)
+        s['rows_out'] = len(decennial)
 
     # subset to positive-population rows
     decennial_subset = decennial[decennial.pop_count > 0]
     decennial_subset = decennial_subset.iloc[start:stop,]
 
     # sample single-year ages from ACS using decennial super structure
-    single_years_df = generate_single_year_df(decennial_subset, age_distribution=age_distribution)
+    with instrument.stage('generate_single_year_df', rows_in = len(decennial_subset)) as s:
+        single_years_df = generate_single_year_df(decennial_subset, age_distribution=age_distribution)
+        s['rows_out'] = len(single_years_df)
     
     # add back in location_cols
-    single_years_df['state'] = single_years_df.geoid.str[:2]
-    single_years_df['county'] = single_years_df.geoid.str[2:5]
-    single_years_df['tract'] = single_years_df.geoid.str[5:11]
-    single_years_df['blkgrp'] = single_years_df.geoid.str[11:]
-    single_years_df.drop(columns=['geoid'], inplace=True)
+    with instrument.stage('format_output', rows_in = len(single_years_df)) as s:
+        single_years_df['state'] = single_years_df.geoid.str[:2]
+        single_years_df['county'] = single_years_df.geoid.str[2:5]
+        single_years_df['tract'] = single_years_df.geoid.str[5:11]
+        single_years_df['blkgrp'] = single_years_df.geoid.str[11:]
+        single_years_df.drop(columns=['geoid'], inplace=True)
 
-    #final order
-    final_cols = ['state','county','tract','blkgrp','sex_id','age','pop_count']
-    output = single_years_df.filter(items=final_cols)
+        #final order
+        final_cols = ['state','county','tract','blkgrp','sex_id','age','pop_count']
+        output = single_years_df.filter(items=final_cols)
+        s['rows_out'] = len(output)
 
     # save to csv
     save_dir = '/home/j/temp/beatrixh/sim_science/outputs/WA_synthetic_pop_distribution/' + '_'.join(races)
     if not os.path.exists(save_dir):
         os.mkdir(save_dir)
-    output.to_csv(save_dir + '/estimates_' + str(start) + '_' + str(stop) + '.csv', index = False)
+    with instrument.stage('write_csv', rows_in = len(output)):
+        output.to_csv(save_dir + '/estimates_' + str(start) + '_' + str(stop) + '.csv', index = False)
+
+    if instrument.enabled:
+        instrument.write_report(save_dir + '/profile_' + str(start) + '_' + str(stop) + '.json',
+                                state = state, races = races, start = start, stop = stop)
+        print(instrument.format_report(), file=sys.stderr)
     
     
 if __name__=="__main__":
@@ -59,5 +80,7 @@ if __name__=="__main__":
     parser.add_argument("races", help="comma-delimited string of acs race vars", type=str)
     parser.add_argument("start", help="to subset decennial df", type=int)
     parser.add_argument("stop", help="to subset decennial df", type=int)
+    instrument.add_args(parser)
     args = parser.parse_args()
+    instrument.enable_from_args(args)
     main(args.state, args.races, args.start, args.stop)
\ No newline at end of file
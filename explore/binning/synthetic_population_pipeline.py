@@ -0,0 +1,164 @@
+import pandas as pd, numpy as np
+import os, sys
+from concurrent.futures import ProcessPoolExecutor
+
+from process_acs import *
+from process_decennial import *
+from sample_data import *
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import instrument
+
+"""Goal: single-year-age synthetic population for a whole state, every race group, in one run.
+
+Replaces running sample_single_year_age_distribution.main once per (race, start, stop) chunk.
+The ACS files and the decennial csv are each read once. format_acs_all builds age
+distributions for every race combination in one pass, and all seven decennial race tables
+come out of one pass over the DHC. Blocks are then split into chunks and sampled in a
+process pool, and each chunk writes its own parquet part under
+    out_dir/race=<group>/part-<chunk>.parquet
+with columns geokey (see geocodes), sex_id, age, pop_count. With instrument enabled
+(--profile or CENSUS_DP_PROFILE), stage timings from the parent and every worker go to
+out_dir/profile.json.
+"""
+
+# decennial sex-by-age table letter -> race group, and the ACS race combinations it pools
+decennial_tables = {'A': 'racwht', 'B': 'racblk', 'C': 'racaian', 'D': 'racasn',
+                    'E': 'racnhpi', 'F': 'racsor', 'G': 'two_or_more'}
+decennial_table_vars = (sex_by_age_white_alone + sex_by_age_black_alone + sex_by_age_aian_alone
+                        + sex_by_age_asian_alone + sex_by_age_nhpi_alone + sex_by_age_otherrace_alone
+                        + sex_by_age_mixed_race)
+
+# set in each worker by _init_worker
+_shared = {}
+
+def main(state, decennial_path = 'WA2010DHCCSV/WA2010DHC.CSV', out_dir = None, n_workers = None,
+         seed = 0, blocks_per_task = 5_000, drop_zeros = False):
+    """ build the synthetic population for one state
+
+    Parameters
+    ----------
+    state : 2-char state abbreviation
+    decennial_path : path of the state's DHC csv, relative to process_decennial.input_dir
+    out_dir : where to write the partitioned parquet output
+    n_workers : process pool size; defaults to os.cpu_count()
+    seed : task (race group g, chunk c) samples with SeedSequence(seed, spawn_key=(g, c))
+    blocks_per_task : blocks per pool task
+    drop_zeros : skip writing rows with pop_count == 0
+
+    Results
+    -------
+    returns out_dir
+    """
+    if out_dir is None:
+        out_dir = '/home/j/temp/beatrixh/sim_science/outputs/' + state.upper() + '_synthetic_pop_distribution_all_races'
+    os.makedirs(out_dir, exist_ok=True)
+
+    with instrument.stage('load_incoming_data') as s:
+        acs = load_incoming_data(state)
+        s['rows_out'] = len(acs)
+    with instrument.stage('format_acs_all', rows_in = len(acs)) as s:
+        acs_all = format_acs_all(acs)
+        s['rows_out'] = len(acs_all)
+    del acs
+    lookups = build_age_lookups(acs_all)
+    decennial = load_decennial_blocks(decennial_path)
+
+    # one task per (race group, run of whole blocks)
+    tasks = []
+    for g, (table, group) in enumerate(decennial_tables.items()):
+        rows = np.flatnonzero(decennial.table.to_numpy() == table)
+        if len(rows) == 0:
+            continue
+        keys = decennial.geokey.to_numpy()[rows]
+        block_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        bounds = np.append(block_starts[::blocks_per_task], len(rows))
+        for c in range(len(bounds) - 1):
+            tasks.append((g, group, c, rows[bounds[c]], rows[bounds[c+1]-1] + 1))
+
+    with instrument.stage('sample_and_write', rows_in = len(decennial)) as s:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(decennial, lookups, out_dir, seed, drop_zeros)) as pool:
+            done = list(pool.map(_run_task, tasks))
+        s['rows_out'] = sum(n for n, records in done)
+        for n, records in done:
+            instrument.add_records(records)
+
+    if instrument.enabled:
+        instrument.write_report(os.path.join(out_dir, 'profile.json'), state = state, n_workers = n_workers,
+                                seed = seed, blocks_per_task = blocks_per_task, n_tasks = len(tasks))
+        print(instrument.format_report(), file=sys.stderr)
+    return out_dir
+
+@instrument.timed()
+def build_age_lookups(acs_all):
+    """ AgeLookup per race group from the format_acs_all table;
+        'two_or_more' pools every combination of 2+ races, and sex/age bins
+        with no ACS people in a group fall back on the all-races distribution
+    """
+    df = acs_all.copy()
+    starts = np.array(decennial_age_starts)
+    df['age_start'] = starts[np.searchsorted(starts, df.age.to_numpy(), side='right') - 1]
+    all_races = AgeLookup(df, weight_col = 'pop_count', age_starts = starts)
+
+    lookups = {}
+    for group in decennial_tables.values():
+        if group == 'two_or_more':
+            sub = df[df.race_count >= 2]
+        else:
+            sub = df[df.race_code == race_code([group])]
+        lookups[group] = AgeLookup(sub, weight_col = 'pop_count', age_starts = starts).fill_empty_bins(all_races)
+    return lookups
+
+@instrument.timed()
+def load_decennial_blocks(decennial_path):
+    """ positive-population block rows of all seven race tables from one pass over the DHC csv,
+        sorted by race table then geokey
+    """
+    chunks = []
+    for df in read_decennial_chunks(decennial_table_vars, path = decennial_path,
+                                    keep_table = True, geoid_strings = False):
+        df = df[df.pop_count > 0]
+        chunks.append(df[['table','geokey','sex_id','age_start','pop_count']].astype(
+            {'sex_id':'int8', 'age_start':'int8'}))
+    df = pd.concat(chunks, ignore_index=True)
+    df['table'] = df.table.astype(str)
+    return df.sort_values(['table','geokey'], kind='stable').reset_index(drop=True)
+
+def _init_worker(decennial, lookups, out_dir, seed, drop_zeros):
+    # with the default fork start method these are inherited, not pickled per task
+    _shared.update(decennial=decennial, lookups=lookups, out_dir=out_dir, seed=seed, drop_zeros=drop_zeros)
+
+def _run_task(task):
+    g, group, c, start, stop = task
+    rows = _shared['decennial'].iloc[start:stop].rename(columns={'geokey':'geoid'})
+    rng = np.random.default_rng(np.random.SeedSequence(_shared['seed'], spawn_key=(g, c)))
+
+    with instrument.stage('generate_single_year_df', rows_in = len(rows)) as s:
+        df = generate_single_year_df(rows, _shared['lookups'][group], rng=rng)
+        s['rows_out'] = len(df)
+    if _shared['drop_zeros']:
+        df = df[df.pop_count > 0]
+    df = df.rename(columns={'geoid':'geokey'}).astype(
+        {'geokey':'int64', 'sex_id':'int8', 'age':'int16', 'pop_count':'int32'})
+
+    part_dir = os.path.join(_shared['out_dir'], 'race=' + group)
+    os.makedirs(part_dir, exist_ok=True)
+    with instrument.stage('write_parquet', rows_in = len(df)):
+        df.to_parquet(os.path.join(part_dir, 'part-{:05d}.parquet'.format(c)), index=False)
+    # the worker's stage records go back with the row count
+    return len(df), instrument.pop_records()
+
+if __name__=="__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("state", help="2-char state abbreviation", type=str)
+    parser.add_argument("--decennial_path", default='WA2010DHCCSV/WA2010DHC.CSV', type=str)
+    parser.add_argument("--out_dir", default=None, type=str)
+    parser.add_argument("--workers", default=None, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--drop_zeros", action='store_true')
+    instrument.add_args(parser)
+    args = parser.parse_args()
+    instrument.enable_from_args(args)
+    main(args.state, args.decennial_path, args.out_dir, args.workers, args.seed, drop_zeros=args.drop_zeros)
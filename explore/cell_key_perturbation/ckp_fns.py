@@ -0,0 +1,108 @@
+import pandas as pd, numpy as np
+
+"""Goal: ABS/ONS-style cell key perturbation, vectorized, for full-state long-format tables.
+
+Every record gets a random record key in [0, b). A cell's key is the sum of its records' keys
+mod b, so the same people always give the same cell key, whichever table the cell is in. The
+noise for a cell is ptable[min(count, M), cell key]: one fancy index over all cells. Counts
+above M share row M (the capped row).
+
+Our tables (sample_data output, aggregate_by_age output) hold counts, not records. The sum of c
+independent uniform keys mod b is itself uniform, so a row with count c > 0 gets one uniform
+key standing for all its records, and a row with count 0 gets key 0. Aggregating rows
+(e.g. single-year ages to a1 bins) then sums their keys mod b, as for records.
+"""
+
+def record_keys(counts, b, rng = None):
+    """ key of each row's records, summed mod b: uniform in [0, b) if count > 0, else 0
+    """
+    rng = np.random.default_rng(rng)
+    counts = np.asarray(counts)
+    return np.where(counts > 0, rng.integers(0, b, size=counts.shape), 0).astype(np.int64)
+
+def add_cell_keys(input_df, count_col, b, by = None, key_col = 'record_key', rng = None):
+    """ cell keys for a long-format table
+
+    Parameters
+    ----------
+    input_df : pd.DataFrame, e.g. the output of sample_data or aggregate_by_age
+    count_col : column of counts
+    b : number of cell key values (= ptable columns)
+    by : columns defining the output cells, e.g. ['geoid','race','sex_id','a1_start'];
+         None treats each row as a cell
+    key_col : column of record keys; made with record_keys if input_df doesn't have it
+    rng : seed or np.random.Generator for new record keys
+
+    Results
+    -------
+    returns a df with by (or input_df's columns), count_col, key_col and 'cell_key'
+    """
+    df = input_df
+    if key_col not in df.columns:
+        df = df.assign(**{key_col: record_keys(df[count_col].to_numpy(), b, rng)})
+    if by is not None:
+        df = df.groupby(list(by), sort=False, observed=True)[[count_col, key_col]].sum().reset_index()
+    else:
+        df = df.copy()
+    df['cell_key'] = df[key_col].to_numpy() % b
+    return df
+
+def make_ptable(M, b, max_noise = 3, alpha = 0.5):
+    """ perturbation table for counts 0 ... M and cell keys 0 ... b-1
+
+    Row c is the inverse CDF, at the b midpoints (j + 0.5)/b, of noise with
+    P(k) proportional to alpha**|k| on -d ... d with d = min(max_noise, c), so noise is
+    symmetric (zero mean), never makes a count negative, and leaves zeros alone.
+
+    Results
+    -------
+    returns an (M+1, b) int np.array
+    """
+    ptable = np.zeros((M + 1, b), dtype=np.int64)
+    u = (np.arange(b) + 0.5) / b
+    for c in range(1, M + 1):
+        d = min(max_noise, c)
+        k = np.arange(-d, d + 1)
+        cdf = np.cumsum(alpha**np.abs(k))
+        ptable[c] = k[np.searchsorted(cdf / cdf[-1], u)]
+    return check_ptable(ptable)
+
+def check_ptable(ptable):
+    """ raise if ptable can't be used: it must be a 2-d int array, row 0 (zero counts) all 0,
+        and no entry in row c below -c, so perturbed counts stay non-negative
+    """
+    ptable = np.asarray(ptable)
+    if ptable.ndim != 2 or ptable.shape[0] < 2 or ptable.dtype.kind not in 'iu':
+        raise Exception("oops; ptable must be a 2-d int array with rows for counts 0 ... M")
+    if (ptable[0] != 0).any():
+        raise Exception("oops; ptable row 0 must be all 0, zero counts stay zero")
+    if (ptable + np.arange(ptable.shape[0])[:, None] < 0).any():
+        raise Exception("oops; ptable has entries that would make counts negative")
+    return ptable
+
+def perturb(input_df, ptable, count_col, key_col = 'cell_key', out_col = None):
+    """ add cell key noise: noise = ptable[min(count, M), cell_key]
+
+    Parameters
+    ----------
+    input_df : df with count_col and key_col, e.g. from add_cell_keys
+    ptable : (M+1, b) table from make_ptable (or any table check_ptable accepts)
+    out_col : name of the perturbed count column; defaults to 'noisy_' + count_col
+
+    Results
+    -------
+    returns a copy of input_df with 'ckp_noise' and out_col added
+    """
+    ptable = check_ptable(ptable)
+    M, b = ptable.shape[0] - 1, ptable.shape[1]
+    counts = input_df[count_col].to_numpy()
+    keys = input_df[key_col].to_numpy()
+    if (counts < 0).any():
+        raise Exception("oops; counts must be non-negative")
+    if (keys < 0).any() or (keys >= b).any():
+        raise Exception("oops; cell keys must be in [0, " + str(b) + ")")
+
+    df = input_df.copy()
+    df['ckp_noise'] = ptable[np.minimum(counts, M).astype(np.int64), keys]
+    df[out_col or 'noisy_' + count_col] = counts + df['ckp_noise'].to_numpy()
+    return df
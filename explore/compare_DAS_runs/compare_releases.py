@@ -0,0 +1,161 @@
+import numpy as np, pandas as pd
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from geocodes import LEVELS
+from geo_hierarchy import GeoHierarchy
+
+"""Goal: compare any number of DAS releases against SF1 on a real geography key, state by state.
+
+Each release is joined to SF1 on an integer key (block geokey from add_loc_cols / add_geoid, or
+any other code such as AIANHH), never by sort order. Block counts are rolled up to every summary
+level with GeoHierarchy, and for each (release, level, population-size bin) we keep sums of
+error, |error|, error^2 and relative error. Those sums merge by addition (ErrorSummary.add), so
+states can be processed one at a time and only the summary stays in memory.
+"""
+
+SIZE_BINS = [0, 1, 10, 100, 1_000, 10_000, 100_000, np.inf]
+
+class ErrorSummary(object):
+    ''' mergeable error sums per (release, level, size bin)
+    '''
+    __slots__ = ['sums']
+    sum_cols = ['n', 'sf', 'err', 'abs_err', 'sq_err', 'n_pos', 'rel_err', 'abs_rel_err']
+
+    def __init__(self, sums = None):
+        if sums is None:
+            index = pd.MultiIndex.from_arrays([[], [], []], names=['release', 'level', 'size_bin'])
+            sums = pd.DataFrame(columns=self.sum_cols, index=index, dtype=float)
+        self.sums = sums
+
+    def add(self, other):
+        return ErrorSummary(self.sums.add(other.sums, fill_value=0))
+
+    def table(self):
+        """ metrics per (release, level, size bin)
+
+        Results
+        -------
+        returns a pd.DataFrame with n, total_sf, total_error (as plotting_fns.find_total_error),
+        mean_error (bias), mean_abs_error, rmse, mean_rel_error and mean_abs_rel_error
+        (relative ones over geographies with sf > 0)
+        """
+        s = self.sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame({'n': s.n.astype(np.int64),
+                                 'total_sf': s.sf,
+                                 'total_error': s.err,
+                                 'mean_error': s.err / s.n,
+                                 'mean_abs_error': s.abs_err / s.n,
+                                 'rmse': np.sqrt(s.sq_err / s.n),
+                                 'mean_rel_error': s.rel_err / s.n_pos,
+                                 'mean_abs_rel_error': s.abs_rel_err / s.n_pos}).sort_index()
+
+def keyed_counts(df, key_col, count_col):
+    """ pd.Series of count_col summed by key_col, e.g. keyed_counts(ca_new, 'geokey', 'asian_alone_new_das')
+    """
+    return df.groupby(key_col, sort=False)[count_col].sum()
+
+def compare(sf, releases, size = None, levels = ('block', 'blkgrp', 'tract', 'county', 'state'),
+            size_bins = SIZE_BINS, missing = 'raise', return_geo = False):
+    """ errors of each release against sf1 at every level, in one vectorized pass per level
+
+    Parameters
+    ----------
+    sf : pd.Series of SF1 counts indexed by int key (block geokey, or e.g. AIANHH code)
+    releases : dict name -> pd.Series of that release's counts indexed by the same keys
+    size : optional pd.Series (same keys) binned into size_bins, e.g. total population;
+           defaults to sf
+    levels : spine levels to roll block keys up to; None compares the keys as they are
+    size_bins : population-size bin edges
+    missing : 'raise' if a release lacks keys sf has, or 'zero' to count them as 0
+    return_geo : also return the per-geography table for each level
+
+    Results
+    -------
+    returns an ErrorSummary, or (ErrorSummary, dict level -> pd.DataFrame) with return_geo
+    """
+    keys = sf.index.to_numpy()
+    names = list(releases)
+    cols = [sf.to_numpy(dtype=float), (sf if size is None else size.reindex(sf.index)).to_numpy(dtype=float)]
+    for name in names:
+        vals = releases[name].reindex(sf.index).to_numpy(dtype=float)
+        if np.isnan(vals).any():
+            if missing == 'raise':
+                raise Exception("oops; release " + str(name) + " is missing " + str(np.isnan(vals).sum()) + " of sf1's keys")
+            vals = np.nan_to_num(vals)
+        cols.append(vals)
+    values = np.column_stack(cols)
+
+    if levels is None:
+        by_level = {'key': (keys, values)}
+    else:
+        hierarchy = GeoHierarchy(keys)
+        by_level = hierarchy.rollup_all(hierarchy.sort_values(values), [i for i in LEVELS if i in levels])
+
+    # an ordered categorical, so tables sort the bins by size rather than as strings
+    bin_names = [_bin_label(size_bins[i], size_bins[i+1]) for i in range(len(size_bins) - 1)]
+    labels = pd.Categorical(bin_names, categories=bin_names, ordered=True)
+    rows, geo = [], {}
+    for level, (codes, sums) in by_level.items():
+        sf_l, size_l, counts = sums[:, 0], sums[:, 1], sums[:, 2:]
+        err = counts - sf_l[:, None]
+        size_bin = np.clip(np.searchsorted(size_bins, size_l, side='right') - 1, 0, len(labels) - 1)
+        pos = sf_l > 0
+        rel = np.zeros_like(err)
+        rel[pos] = err[pos] / sf_l[pos, None]
+
+        n_bins = len(labels)
+        count = lambda w: np.bincount(size_bin, weights=w, minlength=n_bins)
+        n, n_pos, sf_sum = count(None), count(pos.astype(float)), count(sf_l)
+        for j, name in enumerate(names):
+            e = err[:, j]
+            rows.append(pd.DataFrame({'release': name, 'level': level, 'size_bin': labels,
+                                      'n': n, 'sf': sf_sum, 'err': count(e), 'abs_err': count(np.abs(e)),
+                                      'sq_err': count(e**2), 'n_pos': n_pos,
+                                      'rel_err': count(rel[:, j]), 'abs_rel_err': count(np.abs(rel[:, j]))}))
+
+        if return_geo:
+            g = pd.DataFrame({'sf': sf_l, 'size': size_l, 'size_bin': pd.Categorical.from_codes(size_bin, labels.categories, ordered=True)},
+                             index=pd.Index(codes, name=level))
+            for j, name in enumerate(names):
+                g[name] = counts[:, j]
+                g[str(name) + '_error'] = err[:, j]
+            geo[level] = g
+
+    sums = pd.concat(rows, ignore_index=True).set_index(['release', 'level', 'size_bin'])
+    summary = ErrorSummary(sums[ErrorSummary.sum_cols])
+    return (summary, geo) if return_geo else summary
+
+def compare_states(states, load, out_dir = None, **kwargs):
+    """ compare state by state, keeping only the merged summary in memory
+
+    Parameters
+    ----------
+    states : iterable of state ids passed to load
+    load : function state -> (sf, releases) or (sf, releases, size), as compare takes them
+    out_dir : if set, write each state's per-geography tables to
+              out_dir/level=<level>/<state>.parquet
+    kwargs : passed to compare
+
+    Results
+    -------
+    returns an ErrorSummary for all the states together
+    """
+    total = ErrorSummary()
+    for state in states:
+        loaded = load(state)
+        sf, releases = loaded[0], loaded[1]
+        size = loaded[2] if len(loaded) > 2 else None
+        if out_dir is None:
+            summary = compare(sf, releases, size, **kwargs)
+        else:
+            summary, geo = compare(sf, releases, size, return_geo=True, **kwargs)
+            for level, g in geo.items():
+                os.makedirs(os.path.join(out_dir, 'level=' + level), exist_ok=True)
+                g.reset_index().to_parquet(os.path.join(out_dir, 'level=' + level, str(state) + '.parquet'), index=False)
+        total = total.add(summary)
+    return total
+
+def _bin_label(lo, hi):
+    return '[' + str(int(lo)) + ', ' + ('inf' if np.isinf(hi) else str(int(hi))) + ')'
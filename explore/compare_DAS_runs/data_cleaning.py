@@ -1,4 +1,8 @@
 import numpy as np, pandas as pd
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from geocodes import parse_gisjoin, unpack_geoid
 
 rename = {'P0030004_SF':'aian_alone_sf',
           'P0030004_DP':'aian_alone_dp_old',
@@ -26,14 +30,12 @@ def pull_data_aian(path, usecols, groupvar):
 
 def add_loc_cols(df):
 	"""assuming the formatting of the jun20 DAS state files, add location cols
+	and the int64 block 'geokey' (see geocodes) to join on; works for every state
 	"""
 
-	df['STATE'] = [int(i[1:3]) for i in df.gisjoin]
-	df['COUNTY'] = [int(i[4:7]) for i in df.gisjoin]
-	df['TRACT'] = [int(i[7:-4]) for i in df.gisjoin]
-	df['BLOCK'] = [int(i[-4:]) for i in df.gisjoin]
-
-	if df.STATE[0] > 9:
-		raise Exception("Warning! Code might be incorrect for states with fips code > 9")
+	df['geokey'] = parse_gisjoin(df.gisjoin)
+	loc = unpack_geoid(df.geokey)
+	for col in ['STATE','COUNTY','TRACT','BLOCK']:
+		df[col] = loc[col].to_numpy()
 
-	return df
\ No newline at end of file
+	return df
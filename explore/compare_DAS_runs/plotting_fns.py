@@ -1,4 +1,5 @@
-import matplotlib.pyplot as plt, pandas as pd
+import matplotlib.pyplot as plt, pandas as pd, numpy as np
+from matplotlib.colors import LogNorm
 
 def plot_swapping_x_old_v_new(swapping,
                               old_das,
@@ -7,11 +8,35 @@ def plot_swapping_x_old_v_new(swapping,
                               new_label,
                               title,
                               xlab = '2010 census counts with swapping',
-                              ylab = '2010 census counts with DP'):
+                              ylab = '2010 census counts with DP',
+                              mode = 'scatter',
+                              bins = 200,
+                              scale = 'linear'):
+    """ old and new DAS counts against the swapping counts, with the identity line
+    
+    mode : 'scatter' draws every point on one axes; 'binned' draws a Hist2D density
+           panel per release (for block-level comparisons with millions of points)
+    bins, scale : Hist2D bins and 'linear' or 'log' axes, for mode = 'binned'
+    """
     x = swapping
     y0 = old_das
     y1 = new_das
 
+    if mode == 'binned':
+        lo = min(np.nanmin(np.asarray(i, dtype=float)) for i in [x, y0, y1])
+        hi = max(np.nanmax(np.asarray(i, dtype=float)) for i in [x, y0, y1])
+        fig, axes = plt.subplots(1, 2, sharex=True, sharey=True)
+        fig.set_size_inches(16,8)
+        for ax, y, label in zip(axes, [y0, y1], [old_label, new_label]):
+            Hist2D((lo, hi), (lo, hi), bins, scale).add(x, y).plot(ax = ax)
+            ax.set_title(label)
+            ax.set_xlabel(xlab)
+        axes[0].set_ylabel(ylab)
+        fig.suptitle(title)
+        return fig
+    elif mode != 'scatter':
+        raise Exception("oops; mode must be 'scatter' or 'binned'")
+
     fig = plt.figure() 
     fig.set_size_inches(8,8)
 
@@ -48,11 +73,28 @@ def plot_diff_in_DAS_x_swapping(swapping,
                                 label = '',
                                 title = '',
                                 xlab = 'Count size',
-                                ylab = 'Difference between new DAS adjustment and old DAS adjustment'):
-    
+                                ylab = 'Difference between new DAS adjustment and old DAS adjustment',
+                                mode = 'scatter',
+                                bins = 200,
+                                scale = 'linear'):
+    """ new minus old DAS counts against the swapping counts, with the zero line;
+        mode, bins and scale as in plot_swapping_x_old_v_new
+    """
     x = swapping
     y = new_das - old_das
 
+    if mode == 'binned':
+        fig = plt.figure()
+        fig.set_size_inches(8,8)
+        ax = fig.add_subplot(111)
+        Hist2D(bins = bins, scale = scale).add(x, y).plot(ax = ax, identity = False, zero_line = True, label = label)
+        plt.xlabel(xlab)
+        plt.ylabel(ylab)
+        plt.title(title)
+        return
+    elif mode != 'scatter':
+        raise Exception("oops; mode must be 'scatter' or 'binned'")
+
     fig = plt.figure() 
     fig.set_size_inches(8,8)
 
@@ -80,4 +122,115 @@ def find_total_error(new, old, sf1):
     new_error = new - sf1
     old_error = old - sf1
     
-    return pd.DataFrame({'new':[sum(new_error)], 'old':[sum(old_error)]})
\ No newline at end of file
+    return pd.DataFrame({'new':[sum(new_error)], 'old':[sum(old_error)]})
+
+
+class Hist2D(object):
+    ''' 2-d histogram of (x, y) pairs on fixed bins, filled one chunk at a time,
+        for density plots of more points than a scatter can draw
+    
+    'log' bins are even in sign(v)*log(1 + |v|), so zeros and negative differences have bins too;
+    they are drawn on symlog axes. Pairs outside the ranges (or with NaNs) are counted in n_outside, not binned.
+    
+        hist = Hist2D((0, 5000), bins = 300, scale = 'log')
+        for chunk in chunks:
+            hist.add(chunk.sf, chunk.new_das)
+        hist.plot()
+    '''
+    def __init__(self, x_range = None, y_range = None, bins = 200, scale = 'linear'):
+        """
+        Parameters
+        ----------
+        x_range, y_range : (lo, hi) of each axis; None takes it from the first chunk added
+                           (y_range defaults to x_range if that is given)
+        bins : bins per axis, or (x bins, y bins)
+        scale : 'linear' or 'log', or (x scale, y scale)
+        """
+        self.bins = (bins, bins) if np.ndim(bins) == 0 else tuple(bins)
+        self.scale = (scale, scale) if isinstance(scale, str) else tuple(scale)
+        for s in self.scale:
+            if s not in ('linear', 'log'):
+                raise Exception("oops; scale must be 'linear' or 'log'")
+        self.ranges = [x_range, x_range if y_range is None else y_range]
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.n_outside = 0
+    
+    @property
+    def x_edges(self):
+        return self._edges(0)
+    
+    @property
+    def y_edges(self):
+        return self._edges(1)
+    
+    def add(self, x, y):
+        """ bin one chunk of pairs into the counts; returns self
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if x.shape != y.shape:
+            raise Exception("oops; x and y must be the same length")
+        idx, keep = [], np.ones(x.shape, dtype=bool)
+        for axis, v in enumerate([x, y]):
+            if self.ranges[axis] is None:
+                self.ranges[axis] = (np.nanmin(v), np.nanmax(v)) if np.isfinite(v).any() else (0., 1.)
+            # bin i is edges[i] <= v < edges[i+1], and the last bin includes its right edge
+            edges = self._edges(axis)
+            i = np.searchsorted(edges, v, side='right') - 1
+            i[v == edges[-1]] = self.bins[axis] - 1
+            keep &= (i >= 0) & (i < self.bins[axis])
+            idx.append(i)
+        self.counts += np.bincount(idx[0][keep] * self.bins[1] + idx[1][keep],
+                                   minlength=self.bins[0] * self.bins[1]).reshape(self.bins)
+        self.n_outside += int((~keep).sum())
+        return self
+    
+    def merge(self, other):
+        """ add another Hist2D with the same bins (e.g. from another state or process); returns self
+        """
+        if (other.bins != self.bins or other.scale != self.scale
+                or not all(np.allclose(a, b) for a, b in zip(other.ranges, self.ranges))):
+            raise Exception("oops; can only merge histograms with the same ranges, bins and scale")
+        self.counts += other.counts
+        self.n_outside += other.n_outside
+        return self
+    
+    def plot(self, ax = None, identity = True, zero_line = False, cmap = 'viridis', colorbar = True, label = None):
+        """ point density (log color scale, empty bins blank), with the identity line
+            and/or the y = 0 line; returns the axes
+        """
+        ax = plt.gca() if ax is None else ax
+        counts = np.ma.masked_equal(self.counts.T, 0)
+        mesh = ax.pcolormesh(self.x_edges, self.y_edges, counts, cmap = cmap,
+                             norm = LogNorm(vmin = 1, vmax = max(1, self.counts.max())))
+        for s, set_scale in zip(self.scale, [ax.set_xscale, ax.set_yscale]):
+            if s == 'log':
+                set_scale('symlog', linthresh = 1)
+        if colorbar:
+            plt.colorbar(mesh, ax = ax, label = 'number of geographies')
+        
+        (x_lo, x_hi), (y_lo, y_hi) = self.ranges
+        if identity:
+            lim = [max(x_lo, y_lo), min(x_hi, y_hi)]
+            ax.plot(lim, lim, 'red', linewidth=1)
+        if zero_line:
+            ax.plot([x_lo, x_hi], [0, 0], 'red', linewidth=1)
+        if label:
+            ax.text(0.02, 0.98, label, transform = ax.transAxes, va = 'top')
+        return ax
+    
+    def _t(self, axis, v):
+        if self.scale[axis] == 'log':
+            return np.sign(v) * np.log1p(np.abs(v))
+        return v
+    
+    def _edges(self, axis):
+        lo, hi = (self._t(axis, i) for i in self.ranges[axis])
+        t = np.linspace(lo, hi if hi > lo else lo + 1., self.bins[axis] + 1)
+        if self.scale[axis] == 'log':
+            t = np.sign(t) * np.expm1(np.abs(t))
+            # the log1p / expm1 round trip can land the end edges just inside the range
+            t[0] = self.ranges[axis][0]
+            if hi > lo:
+                t[-1] = self.ranges[axis][1]
+        return t
\ No newline at end of file
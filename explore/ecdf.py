@@ -0,0 +1,143 @@
+import numpy as np, pandas as pd
+
+"""Goal: answer "how many geographies have a count at or below x" for many x without rescanning the table.
+
+ECDF sorts each count column once, within each group if there are groups (race, county,
+urban/rural, ...). A batch of thresholds is then one np.searchsorted per group and column:
+O(log n) per threshold instead of the full filtered copy that df[df[var] <= x].shape[0] makes
+for every x. Missing values are left out, as df[var] <= x leaves them out.
+
+    e = ECDF(df, ['pop_count', 'noisy_counts', 'nonneg_counts'], by = 'race')
+    e.count_leq([0, 1, 5, 10], 'nonneg_counts')      # (groups, thresholds) counts
+    e.table(1.2**np.arange(35))                        # long df: race, var, x, count, n, frac
+    e.steps('pop_count')                               # exact step function, for plt.step
+"""
+
+class ECDF(object):
+    ''' empirical CDFs of one or more columns of a df, optionally by group
+    '''
+    def __init__(self, df, cols, by = None):
+        """
+        Parameters
+        ----------
+        df : pd.DataFrame
+        cols : column or list of columns to index, e.g. ['pop_count', 'nonneg_counts']
+        by : optional column or list of columns to group by, e.g. 'race' or ['COUNTY', 'UR']
+        """
+        self.cols = [cols] if isinstance(cols, str) else list(cols)
+        self.by = None if by is None else ([by] if isinstance(by, str) else list(by))
+        missing = [i for i in self.cols + (self.by or []) if i not in df.columns]
+        if missing:
+            raise Exception("oops; df has no columns " + str(missing))
+
+        if self.by is None:
+            codes = np.zeros(len(df), dtype=np.int64)
+            self.groups = None
+            n_groups = 1
+        else:
+            grouped = df.groupby(self.by, sort=True, observed=True, dropna=False)
+            codes = grouped.ngroup().to_numpy()
+            self.groups = grouped.size().index
+            n_groups = len(self.groups)
+
+        # rows of group g sit in starts[g] ... starts[g+1] of every sorted column;
+        # its n[col][g] non-missing values come first, sorted ascending
+        self.starts = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=n_groups), out=self.starts[1:])
+        self.values, self.n = {}, {}
+        for col in self.cols:
+            vals = df[col].to_numpy()
+            if vals.dtype.kind not in 'iuf':
+                vals = pd.to_numeric(df[col]).to_numpy(dtype=float, na_value=np.nan)
+            present = ~np.isnan(vals) if vals.dtype.kind == 'f' else np.ones(len(vals), dtype=bool)
+            # by group, then missing values last, then by value
+            order = np.lexsort((vals, ~present, codes))
+            self.values[col] = vals[order]
+            self.n[col] = np.bincount(codes[present], minlength=n_groups)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def count_leq(self, x, col = None, strict = False):
+        """ number of values <= x (< x with strict) in each group
+
+        Parameters
+        ----------
+        x : threshold or array of thresholds
+        col : indexed column; may be left out if only one is indexed
+        strict : count values < x instead
+
+        Results
+        -------
+        returns an int np.array shaped like x, or (groups, *x.shape) with by
+        """
+        x = np.asarray(x)
+        vals, n = self.values[self._col(col)], self.n[self._col(col)]
+        side = 'left' if strict else 'right'
+        out = np.empty((len(self),) + x.shape, dtype=np.int64)
+        for g in range(len(self)):
+            start = self.starts[g]
+            out[g] = np.searchsorted(vals[start:start + n[g]], x, side=side)
+        return out[0] if self.by is None else out
+
+    def frac_leq(self, x, col = None, strict = False):
+        """ count_leq as a fraction of each group's non-missing values
+        """
+        counts = self.count_leq(x, col, strict)
+        n = self.n[self._col(col)].reshape((-1,) + (1,) * np.ndim(x))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return counts / (n[0] if self.by is None else n)
+
+    def table(self, x, cols = None, strict = False):
+        """ count_leq and frac_leq for every threshold, column and group, in long format
+
+        Results
+        -------
+        returns a pd.DataFrame with the by columns, var, x, count, n and frac
+        (one row per group x column x threshold), ready for e.g. seaborn or df.pivot
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        tables = []
+        for col in self.cols if cols is None else ([cols] if isinstance(cols, str) else cols):
+            counts = np.atleast_2d(self.count_leq(x, col, strict))
+            n = np.repeat(self.n[col], len(x))
+            df = pd.DataFrame({'var': col, 'x': np.tile(x, len(self)), 'count': counts.ravel(), 'n': n})
+            with np.errstate(invalid='ignore', divide='ignore'):
+                df['frac'] = df['count'] / df['n']
+            if self.by is not None:
+                keys = self.groups.to_frame(index=False).loc[np.repeat(np.arange(len(self)), len(x))]
+                df = pd.concat([keys.reset_index(drop=True), df], axis=1)
+            tables.append(df)
+        return pd.concat(tables, ignore_index=True)
+
+    def steps(self, col = None, group = None):
+        """ the exact ECDF of one group: distinct values and the count at or below each
+
+        Parameters
+        ----------
+        group : the group's key, as in self.groups (a tuple with several by columns); not needed without by
+
+        Results
+        -------
+        returns (values, counts), for plt.step(values, counts, where='post')
+        """
+        col = self._col(col)
+        if self.by is None:
+            g = 0
+        elif group is None:
+            raise Exception("oops; pick a group, one of self.groups")
+        else:
+            g = self.groups.get_loc(group)
+        start = self.starts[g]
+        vals = self.values[col][start:start + self.n[col][g]]
+        last = np.r_[vals[1:] != vals[:-1], True] if len(vals) else np.zeros(0, dtype=bool)
+        return vals[last], np.flatnonzero(last) + 1
+
+    def _col(self, col):
+        if col is None:
+            if len(self.cols) > 1:
+                raise Exception("oops; several columns are indexed, pick one of " + str(self.cols))
+            return self.cols[0]
+        if col not in self.values:
+            raise Exception("oops; " + str(col) + " is not indexed; indexed columns are " + str(self.cols))
+        return col
@@ -0,0 +1,131 @@
+import pandas as pd, numpy as np
+
+from geocodes import LEVELS, LEVEL_DIVISORS
+
+"""Goal: roll block-level counts up to blkgrp/tract/county/state (and AIANHH, UA, UR, ...) fast.
+
+Blocks are sorted once by their int64 geokey (see geocodes). Because every spine level is a
+key prefix, each tract/county/... is then a contiguous run of blocks, so
+    - a rollup of any number of count columns is one np.add.reduceat per level, and
+    - "all blocks in tract X" is a slice of the sorted arrays, i.e. a view, not a copy.
+Off-spine geographies (AIANHH, UA, UR) get their own sort permutation and run offsets.
+"""
+
+class GeoHierarchy(object):
+    ''' sorted block keys plus segment offsets for every level
+
+        codes[level] : sorted unique codes of that level (key // LEVEL_DIVISORS[level])
+        starts[level] : offset of each code's first block in sorted order
+    '''
+    def __init__(self, geokey, offspine = None):
+        """
+        Parameters
+        ----------
+        geokey : array-like of unique int64 block keys
+        offspine : optional dict name -> array-like of codes per block (NaN = not in any),
+                   e.g. {'AIANHH': df.AIANHH, 'UA': df.UA}
+        """
+        geokey = np.asarray(geokey, dtype=np.int64)
+        self.order = np.argsort(geokey, kind='stable')
+        self.keys = geokey[self.order]
+        if (self.keys[1:] == self.keys[:-1]).any():
+            raise ValueError("block keys must be unique; sum duplicate rows first")
+
+        self.codes, self.starts = {}, {}
+        for level in LEVELS:
+            level_codes = self.keys // LEVEL_DIVISORS[level]
+            starts = np.flatnonzero(np.r_[True, level_codes[1:] != level_codes[:-1]])
+            self.codes[level], self.starts[level] = level_codes[starts], starts
+
+        # off-spine: permutation of sorted blocks that groups them by code
+        self.offspine = {}
+        for name, vals in (offspine or {}).items():
+            labels, uniques = pd.factorize(np.asarray(vals)[self.order], sort=True)
+            perm = np.argsort(labels, kind='stable')
+            perm = perm[labels[perm] >= 0] # blocks outside every area drop out
+            sorted_labels = labels[perm]
+            starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) if len(perm) else np.array([], dtype=np.int64)
+            self.offspine[name] = (np.asarray(uniques)[sorted_labels[starts]], perm, starts)
+
+    @classmethod
+    def from_frame(cls, df, key_col = 'geokey', offspine_cols = ()):
+        return cls(df[key_col].to_numpy(), {i: df[i].to_numpy() for i in offspine_cols})
+
+    def sort_values(self, values):
+        ''' put per-block values (n,) or (n, k), in input row order, into sorted block order;
+            do this once, then rollups and slices on the result are cheap
+        '''
+        return np.asarray(values)[self.order]
+
+    def rollup(self, sorted_values, level):
+        ''' sums per code of level (a spine level or an off-spine name) of sorted_values
+
+            Results
+            -------
+            returns (codes, sums) with one row of sums per code
+        '''
+        sorted_values = np.asarray(sorted_values)
+        if level in self.offspine:
+            codes, perm, starts = self.offspine[level]
+            if len(perm) == 0:
+                return codes, np.zeros((0,) + sorted_values.shape[1:], dtype=sorted_values.dtype)
+            return codes, np.add.reduceat(sorted_values[perm], starts, axis=0)
+        return self.codes[level], np.add.reduceat(sorted_values, self.starts[level], axis=0)
+
+    def rollup_all(self, sorted_values, levels = None):
+        ''' rollups for many levels at once; each spine level is reduced from the next finer
+            level's sums rather than from the blocks again
+
+            Results
+            -------
+            returns dict level -> (codes, sums)
+        '''
+        levels = list(LEVELS) + list(self.offspine) if levels is None else list(levels)
+        sorted_values = np.asarray(sorted_values)
+        out = {}
+
+        # spine, finest first
+        finer_sums, finer_starts = sorted_values, np.arange(len(self.keys))
+        for level in LEVELS[::-1]:
+            if not any(i in levels for i in LEVELS[:LEVELS.index(level)+1]):
+                break
+            pos = np.searchsorted(finer_starts, self.starts[level])
+            finer_sums = np.add.reduceat(finer_sums, pos, axis=0) if len(pos) else finer_sums[:0]
+            finer_starts = self.starts[level]
+            if level in levels:
+                out[level] = (self.codes[level], finer_sums)
+
+        for name in self.offspine:
+            if name in levels:
+                out[name] = self.rollup(sorted_values, name)
+        return out
+
+    def rollup_frame(self, df, count_cols, levels = None):
+        ''' rollup_all for df columns count_cols (df rows in the order the index was built with)
+
+            Results
+            -------
+            returns dict level -> pd.DataFrame of sums indexed by that level's code
+        '''
+        sums = self.rollup_all(self.sort_values(df[count_cols].to_numpy()), levels)
+        return {level: pd.DataFrame(vals, columns=count_cols, index=pd.Index(codes, name=level))
+                for level, (codes, vals) in sums.items()}
+
+    def blocks_in(self, level, code):
+        ''' positions (in sorted order) of the blocks in one geography:
+            a slice for spine levels, an index array for off-spine ones
+        '''
+        if level in self.offspine:
+            codes, perm, starts = self.offspine[level]
+            i = np.searchsorted(codes, code)
+            if i == len(codes) or codes[i] != code:
+                raise KeyError(str(code) + " not in " + level)
+            stop = starts[i+1] if i+1 < len(starts) else len(perm)
+            return perm[starts[i]:stop]
+
+        codes, starts = self.codes[level], self.starts[level]
+        i = np.searchsorted(codes, code)
+        if i == len(codes) or codes[i] != code:
+            raise KeyError(str(code) + " not in " + level)
+        stop = starts[i+1] if i+1 < len(starts) else len(self.keys)
+        return slice(starts[i], stop)
@@ -0,0 +1,82 @@
+import pandas as pd, numpy as np
+
+"""Goal: one int64 key per census block instead of 15-character geoid strings.
+
+A block GEOID is SS CCC TTTTTT BBBB (state, county, tract, block; the block's first digit is
+its block group), so the key is just that 15-digit number:
+    key = STATE * 10**13 + COUNTY * 10**10 + TRACT * 10**4 + BLOCK
+Every coarser geography is an integer prefix, key // LEVEL_DIVISORS[level], which is also the
+numeric value of that level's own GEOID (e.g. the 11-digit tract GEOID).
+"""
+
+LEVELS = ['state', 'county', 'tract', 'blkgrp', 'block']
+LEVEL_DIVISORS = {'state': 10**13, 'county': 10**10, 'tract': 10**4, 'blkgrp': 10**3, 'block': 1}
+LEVEL_WIDTHS = {'state': 2, 'county': 5, 'tract': 11, 'blkgrp': 12, 'block': 15}
+FIELD_LIMITS = {'STATE': 10**2, 'COUNTY': 10**3, 'TRACT': 10**6, 'BLOCK': 10**4}
+
+def pack_geoid(state, county, tract, block):
+    """ pack STATE/COUNTY/TRACT/BLOCK columns into int64 block keys
+
+    Parameters
+    ----------
+    state, county, tract, block : array-likes of ints (floats with no NaNs are fine)
+
+    Results
+    -------
+    returns an int64 np.array of keys
+    """
+    fields = {'STATE': state, 'COUNTY': county, 'TRACT': tract, 'BLOCK': block}
+    for name, vals in fields.items():
+        vals = np.asarray(vals)
+        if vals.dtype.kind == 'f' and np.isnan(vals).any():
+            raise ValueError(name + " has missing values; subset to block rows first")
+        vals = vals.astype(np.int64)
+        if ((vals < 0) | (vals >= FIELD_LIMITS[name])).any():
+            raise ValueError(name + " out of range for a census GEOID")
+        fields[name] = vals
+    return (fields['STATE'] * LEVEL_DIVISORS['state'] + fields['COUNTY'] * LEVEL_DIVISORS['county']
+            + fields['TRACT'] * LEVEL_DIVISORS['tract'] + fields['BLOCK'])
+
+def unpack_geoid(key):
+    """ split block keys back into a df of STATE/COUNTY/TRACT/BLKGRP/BLOCK ints
+    """
+    key = np.asarray(key, dtype=np.int64)
+    return pd.DataFrame({'STATE': key // LEVEL_DIVISORS['state'],
+                         'COUNTY': key // LEVEL_DIVISORS['county'] % 1000,
+                         'TRACT': key // LEVEL_DIVISORS['tract'] % 10**6,
+                         'BLKGRP': key // LEVEL_DIVISORS['blkgrp'] % 10,
+                         'BLOCK': key % 10**4})
+
+def level_code(key, level):
+    """ integer code of the level (state ... block) each block key falls in
+    """
+    return np.asarray(key, dtype=np.int64) // LEVEL_DIVISORS[level]
+
+def parent_code(code, level, parent_level):
+    """ code of the parent_level geography containing each level code
+    """
+    if LEVELS.index(parent_level) > LEVELS.index(level):
+        raise ValueError(parent_level + " is not above " + level)
+    return np.asarray(code, dtype=np.int64) // (LEVEL_DIVISORS[parent_level] // LEVEL_DIVISORS[level])
+
+def geoid_to_key(geoids, level='block'):
+    """ vectorized parse of GEOID strings (any state) into int64 codes for level
+    """
+    s = pd.Series(geoids, copy=False).astype(str)
+    if (s.str.len() != LEVEL_WIDTHS[level]).any():
+        raise ValueError("GEOIDs must be " + str(LEVEL_WIDTHS[level]) + " digits for level " + level)
+    return s.astype(np.int64).to_numpy()
+
+def key_to_geoid(key, level='block'):
+    """ zero-padded GEOID strings for int64 codes at level
+    """
+    return pd.Series(np.asarray(key, dtype=np.int64)).astype(str).str.zfill(LEVEL_WIDTHS[level]).to_numpy()
+
+def parse_gisjoin(gisjoin):
+    """ vectorized parse of NHGIS block gisjoin strings, G SS 0 CCC 0 TTTTTT BBBB, into block keys
+    """
+    s = pd.Series(gisjoin, copy=False).astype(str)
+    if (s.str.len() != 18).any() or (s.str[0] != 'G').any():
+        raise ValueError("expected 18-character block gisjoin values like G53000109501001001")
+    return pack_geoid(s.str[1:3].astype(np.int64), s.str[4:7].astype(np.int64),
+                      s.str[7:-4].astype(np.int64), s.str[-4:].astype(np.int64))
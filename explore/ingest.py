@@ -0,0 +1,63 @@
+import pandas as pd, numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from parquet_cache import cached_read_csv
+
+"""Goal: read many csvs that share a schema (ACS years, synthetic-pop output chunks) in one go.
+
+Files are parsed concurrently in a thread pool, each restricted to the wanted columns with
+a fixed compact dtype, and concatenated once at the end instead of growing a df in a loop.
+"""
+
+def read_csv_files(paths, usecols=None, dtype=None, assign=None, lowercase=False,
+                   max_workers=None, use_cache=True, partition_values=None):
+    """ read a list of csvs concurrently and concatenate them once
+
+    Parameters
+    ----------
+    paths : list of csv paths
+    usecols : columns to keep; files missing some of them just don't get them
+    dtype : dict of column -> dtype applied while parsing
+    assign : optional list (one per path) of dicts of constant columns to add, e.g. {'year': 2016}
+    lowercase : match usecols/dtype against lowercased headers, and lowercase the output columns
+    max_workers : thread pool size
+    use_cache : read through parquet_cache
+    partition_values : optional list (one per path) of cache partition dicts
+
+    Results
+    -------
+    returns one pd.DataFrame; constant columns keep the dtype given in dtype if any
+    """
+    paths = list(paths)
+    if not paths:
+        return pd.DataFrame(columns=usecols)
+    assign = assign or [{}]*len(paths)
+    partition_values = partition_values or [None]*len(paths)
+
+    def read_one(i):
+        cols, types, rename = _resolve_columns(paths[i], usecols, dtype, lowercase)
+        df = cached_read_csv(paths[i], usecols=cols, dtype=types,
+                             partition_values=partition_values[i], use_cache=use_cache)
+        df = df.rename(columns=rename)
+        for col, val in assign[i].items():
+            df[col] = pd.Series(val, index=df.index, dtype=(dtype or {}).get(col))
+        return df
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        dfs = list(pool.map(read_one, range(len(paths))))
+
+    df = pd.concat(dfs, ignore_index=True)
+    if usecols is not None:
+        df = df.filter(items=usecols)
+    return df
+
+def _resolve_columns(path, usecols, dtype, lowercase):
+    """ map wanted (possibly lowercase) column names onto the file's actual header
+    """
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    norm = {i: (i.lower() if lowercase else i) for i in header}
+    cols = [i for i in header if usecols is None or norm[i] in usecols]
+    types = {i: dtype[norm[i]] for i in cols if dtype and norm[i] in dtype}
+    rename = {i: norm[i] for i in cols if norm[i] != i}
+    return cols, types, rename
@@ -0,0 +1,222 @@
+import os, sys, time, json, resource, functools, contextlib, cProfile, datetime
+
+"""Goal: see where a slow job's time and memory go, stage by stage, without slowing it when off.
+
+    with instrument.stage('read_decennial') as s:
+        df = read_decennial(...)
+        s['rows_out'] = len(df)
+
+    @instrument.timed('format_acs')          # rows_in / rows_out from len() of first arg / result
+    def format_acs(...): ...
+
+Each stage records wall time, CPU time (this process), rows in/out, the process's memory
+high-water mark (ru_maxrss) when the stage ends, a span id, its parent's span id and its path
+(the names of the stages it runs inside, then its own). Off unless the
+CENSUS_DP_PROFILE env var is set (to anything but '' or '0') or enable() is called, e.g. from a
+--profile flag; when off, stage() hands back a throwaway dict and does nothing else.
+Setting CENSUS_DP_PROFILE_STAGE (or enable(profile_stage=...)) also runs that stage under
+cProfile and dumps its stats to profile_dir/<stage>-<pid>-<n>.prof, for pstats / snakeviz.
+report() / write_report() give the per-run summary. Records live per process: pool workers
+hand theirs back with pop_records() and the parent adds them with add_records().
+"""
+
+enabled = os.environ.get('CENSUS_DP_PROFILE', '') not in ('', '0')
+profile_stage = os.environ.get('CENSUS_DP_PROFILE_STAGE') or None
+profile_dir = os.environ.get('CENSUS_DP_PROFILE_DIR', '.')
+
+# stage name -> qualified name of each function decorated with timed
+registry = {}
+
+_records = []
+_stack = []     # records of the stages running now, outermost first
+_n_spans = [0]
+_run_start = time.time()
+_off = {}
+
+def enable(on = True, profile_stage = None, profile_dir = None):
+    """ turn recording on (or off); optionally pick a stage to cProfile and where its stats go
+    """
+    global enabled, _run_start
+    enabled = bool(on)
+    if profile_stage is not None:
+        globals()['profile_stage'] = profile_stage
+    if profile_dir is not None:
+        globals()['profile_dir'] = profile_dir
+    if enabled and not _records:
+        _run_start = time.time()
+
+def add_args(parser):
+    """ add --profile / --profile_stage / --profile_dir to an argparse parser
+    """
+    parser.add_argument("--profile", action='store_true', help="record per-stage time and memory")
+    parser.add_argument("--profile_stage", default=None, type=str, help="also cProfile this stage")
+    parser.add_argument("--profile_dir", default=None, type=str, help="where .prof files go")
+    return parser
+
+def enable_from_args(args):
+    """ enable() if args has --profile or --profile_stage set
+    """
+    if args.profile or args.profile_stage:
+        enable(profile_stage=args.profile_stage, profile_dir=args.profile_dir)
+
+@contextlib.contextmanager
+def stage(name, rows_in = None):
+    """ record one run of a named stage; yields a dict the caller may set 'rows_out' (or any
+        other key) on
+    """
+    if not enabled:
+        yield _off
+        return
+    # a forked pool worker inherits its parent's open stages; those aren't this process's
+    parent = _stack[-1] if _stack and _stack[-1]['pid'] == os.getpid() else None
+    _n_spans[0] += 1
+    record = {'stage': name, 'id': '{}-{}'.format(os.getpid(), _n_spans[0]),
+              'parent': parent and parent['stage'], 'parent_id': parent and parent['id'],
+              'path': (parent['path'] if parent else []) + [name], 'depth': len(parent['path']) if parent else 0,
+              'pid': os.getpid(), 'rows_in': rows_in, 'rows_out': None}
+    profiler = cProfile.Profile() if name == profile_stage else None
+    _stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_s'] = time.perf_counter() - wall
+        record['cpu_s'] = time.process_time() - cpu
+        record['max_rss_mb'] = max_rss_mb()
+        _stack.pop()
+        if profiler is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+            n = sum(1 for i in _records if i['stage'] == name and i['pid'] == record['pid'])
+            record['prof'] = os.path.join(profile_dir, '{}-{}-{}.prof'.format(name, record['pid'], n))
+            profiler.dump_stats(record['prof'])
+        _records.append(record)
+
+def timed(name = None):
+    """ decorator recording each call as a stage (default name: the function's name), with
+        rows_in = len(first argument) and rows_out = len(result) where those have a length
+    """
+    def wrap(fn):
+        stage_name = name or fn.__name__
+        registry[stage_name] = fn.__module__ + '.' + fn.__qualname__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with stage(stage_name, rows_in=_len(args[0]) if args else None) as s:
+                result = fn(*args, **kwargs)
+                s['rows_out'] = _len(result)
+            return result
+        return wrapper
+    return wrap
+
+def records():
+    """ copies of this process's stage records, in the order the stages finished
+    """
+    return [dict(i) for i in _records]
+
+def pop_records():
+    """ this process's records, clearing them (for a pool worker to return to the parent);
+        records a forked worker inherited from its parent are dropped, not returned
+    """
+    pid = os.getpid()
+    out = [i for i in _records if i['pid'] == pid]
+    del _records[:]
+    return out
+
+def add_records(more):
+    """ add records from another process, e.g. pop_records() results from pool workers;
+        their stages are nested under the stage running here, if any
+    """
+    for r in more:
+        if _stack:
+            top = _stack[-1]
+            r = dict(r, path=top['path'] + r['path'], depth=len(top['path']) + r['depth'])
+            if r['parent_id'] is None:
+                r.update(parent=top['stage'], parent_id=top['id'])
+        _records.append(r)
+
+def reset():
+    global _run_start
+    del _records[:]
+    _run_start = time.time()
+
+def report():
+    """ per-stage totals: calls, wall_s, cpu_s, rows_in, rows_out and the largest max_rss_mb,
+        in order of first appearance; runs of a stage at the same path (e.g. in several
+        processes) are summed together
+
+    Results
+    -------
+    returns a list of dicts, one per stage path
+    """
+    out = {}
+    for r in _records:
+        s = out.setdefault(tuple(r['path']), {'stage': r['stage'], 'parent': r['parent'], 'path': r['path'],
+                                              'calls': 0, 'wall_s': 0., 'cpu_s': 0., 'rows_in': None,
+                                              'rows_out': None, 'max_rss_mb': 0., 'processes': set()})
+        s['calls'] += 1
+        s['wall_s'] += r['wall_s']
+        s['cpu_s'] += r['cpu_s']
+        s['max_rss_mb'] = max(s['max_rss_mb'], r['max_rss_mb'])
+        s['processes'].add(r['pid'])
+        for col in ['rows_in', 'rows_out']:
+            if r.get(col) is not None:
+                s[col] = (s[col] or 0) + r[col]
+    for s in out.values():
+        s['processes'] = len(s['processes'])
+    return list(out.values())
+
+def write_report(path, **run_info):
+    """ write the run report as json: run_info (e.g. job parameters), argv, start time,
+        per-stage totals and the raw records; returns path
+    """
+    doc = {'run': dict(run_info, argv=sys.argv, pid=os.getpid(),
+                       started=datetime.datetime.fromtimestamp(_run_start).isoformat(timespec='seconds'),
+                       elapsed_s=time.time() - _run_start, max_rss_mb=max_rss_mb()),
+           'stages': report(), 'records': records()}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(doc, f, indent=1, default=str)
+    return path
+
+def format_report():
+    """ report() as an indented text table
+    """
+    lines = ['{:<36} {:>6} {:>10} {:>10} {:>12} {:>12} {:>10}'.format(
+        'stage', 'calls', 'wall_s', 'cpu_s', 'rows_in', 'rows_out', 'max_rss_mb')]
+    stages = report()
+    paths = set(tuple(s['path']) for s in stages)
+
+    # each stage under its parent path (parents finish, and so are recorded, after their children);
+    # paths only get longer going down, so a stage nested in one of the same name still ends
+    children = {}
+    for s in stages:
+        parent = tuple(s['path'][:-1])
+        children.setdefault(parent if parent in paths else None, []).append(s)
+    def add(parent, depth):
+        for s in children.get(parent, []):
+            lines.append('{:<36} {:>6} {:>10.3f} {:>10.3f} {:>12} {:>12} {:>10.1f}'.format(
+                '  ' * depth + s['stage'], s['calls'], s['wall_s'], s['cpu_s'],
+                '' if s['rows_in'] is None else s['rows_in'], '' if s['rows_out'] is None else s['rows_out'],
+                s['max_rss_mb']))
+            add(tuple(s['path']), depth + 1)
+    add(None, 0)
+    return '\n'.join(lines)
+
+def max_rss_mb():
+    """ this process's memory high-water mark in MB (ru_maxrss is KB on linux, bytes on macOS)
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.**2 if sys.platform == 'darwin' else 1024.)
+
+def _len(x):
+    if isinstance(x, (str, bytes)):
+        return None
+    try:
+        return len(x)
+    except TypeError:
+        return None
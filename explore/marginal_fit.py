@@ -0,0 +1,162 @@
+import pandas as pd, numpy as np
+import warnings
+
+"""Goal: post-process noisy race x sex x age cells so several margins match published totals.
+
+min_x ||x - v||^2  s.t.  x >= 0, and for each margin m and group g: sum(x[labels_m == g]) == totals_m[g]
+
+Only the cells that exist (rows of a long table like aggregate_by_age's output) are stored, and
+each margin is a group label per cell, so nothing is densified into the full
+geography x race x sex x age cube. A applies the margins (cells -> group sums, one bincount
+per margin) and A^T spreads group values back onto cells (one gather per margin).
+
+Solved in the dual, with one multiplier per margin group: given multipliers lam, the best x is
+max(v + A^T lam, 0), and the dual objective lam.b - |x|^2/2 is concave and piecewise quadratic.
+It is maximized by semismooth Newton: each step solves (A D A^T) d = b - A x, with D = 1 on cells
+where x > 0 (and a 1e-2 floor elsewhere), by conjugate gradient preconditioned with
+diag(A D A^T), then backtracks until the dual improves (Armijo). The loop stops once every margin
+is within tol (max_iter bounds the Newton steps, cg_iter the CG iterations per step) and warns if
+it runs out of steps. Once the set of positive cells stops changing, Newton converges fast
+(locally superlinearly); the inexact CG solves trade some of that for cheaper steps. The margins
+must be consistent (e.g. every margin has the same grand total) for an exact fit to exist.
+"""
+
+def fit_margins(v, margins, tol = 1e-6, max_iter = 100, cg_iter = 200):
+    """ non-negative least-squares fit of v to several margins
+
+    Parameters
+    ----------
+    v : 1-d array-like of noisy cell counts
+    margins : list of (labels, totals): labels is an int array giving each cell's group
+              (0 ... n_groups-1), totals the target sum of each group
+    tol : stop once every margin is within tol (times the largest total, if that is > 1)
+    max_iter : max Newton steps
+    cg_iter : max conjugate gradient iterations per Newton step
+
+    Results
+    -------
+    returns x, a float np.array like v
+    """
+    margins = _check_margins(margins, len(v))
+    # work in the first margin's group order, so every bincount and gather walks memory in order
+    order = np.argsort(margins[0][0], kind='stable') if margins else np.arange(len(v))
+    v = np.asarray(v, dtype=float)[order]
+    margins = [(labels[order], totals) for labels, totals in margins]
+    b = np.concatenate([totals for labels, totals in margins] + [np.zeros(0)])
+    scale = tol * max([1.] + [np.abs(b).max()] if len(b) else [1.])
+
+    # A: cells -> margin group sums, and its transpose: group values -> cells
+    offsets = np.cumsum([0] + [len(totals) for labels, totals in margins])
+    A = lambda y: np.concatenate([np.bincount(labels, weights=y, minlength=len(totals))
+                                  for labels, totals in margins] + [np.zeros(0)])
+    At = lambda lam: sum([lam[offsets[j]:offsets[j+1]][labels] for j, (labels, totals) in enumerate(margins)],
+                         np.zeros_like(v))
+    dual = lambda x, lam: lam @ b - 0.5 * (x @ x)
+
+    lam = np.zeros(len(b))
+    x = np.maximum(v, 0)
+    for i in range(max_iter):
+        grad = b - A(x)
+        if np.abs(grad).max(initial=0) <= scale:
+            break
+
+        # Newton direction: (A D A^T) d = grad with D = 1 on cells where x > 0 (and a small floor
+        # elsewhere, so groups with no positive cells don't get huge steps), by conjugate gradient
+        # preconditioned with diag(A D A^T), i.e. each group's total weight
+        active = np.where(x > 0, 1., 1e-2)
+        diag = A(active)
+        # groups with no cells (allowed when their total is 0) have a zero row; leave their multiplier alone
+        inv_diag = np.divide(1., diag, out=np.zeros_like(diag), where=diag > 0)
+        d = _cg(lambda y: A(active * At(y)), grad, cg_iter, inv_diag)
+
+        # backtrack until the dual objective improves enough
+        step, current, slope = 1., dual(x, lam), grad @ d
+        while True:
+            new_lam = lam + step * d
+            new_x = np.maximum(v + At(new_lam), 0)
+            if dual(new_x, new_lam) >= current + 1e-4 * step * slope or step < 1e-10:
+                break
+            step /= 2
+        lam, x = new_lam, new_x
+
+    else:
+        warnings.warn("fit_margins stopped after " + str(max_iter) + " steps with max margin violation "
+                      + str(np.abs(b - A(x)).max(initial=0)))
+
+    out = np.empty_like(x)
+    out[order] = x
+    return out
+
+def fit_margins_frame(df, value_col, margin_totals, out_col = 'fitted_counts', **kwargs):
+    """ fit_margins on a long table, e.g. fit das output cells to published totals
+
+    Parameters
+    ----------
+    df : pd.DataFrame with one row per cell
+    value_col : column of noisy counts
+    margin_totals : list of pd.Series of target totals, each indexed by some of df's columns,
+                    e.g. true.groupby(['geoid','race'])['pop_count'].sum()
+    out_col : name of the new column
+    kwargs : passed to fit_margins
+
+    Results
+    -------
+    returns a copy of df with out_col added
+    """
+    margins = []
+    for totals in margin_totals:
+        cols = list(totals.index.names)
+        labels = pd.MultiIndex.from_frame(df[cols]) if len(cols) > 1 else pd.Index(df[cols[0]])
+        codes = totals.index.get_indexer(labels)
+        if (codes < 0).any():
+            raise Exception("oops; df has cells in groups missing from the " + str(cols) + " totals")
+        margins.append((codes, totals.to_numpy(dtype=float)))
+
+    df = df.copy()
+    df[out_col] = fit_margins(df[value_col].to_numpy(), margins, **kwargs)
+    return df
+
+def _check_margins(margins, n):
+    """ validate margins and make them (int labels, float totals)
+    """
+    out = []
+    grand_totals = []
+    for labels, totals in margins:
+        labels = np.asarray(labels, dtype=np.int64)
+        totals = np.asarray(totals, dtype=float)
+        if labels.shape != (n,):
+            raise Exception("oops; every margin needs one label per cell")
+        if len(labels) and (labels.min() < 0 or labels.max() >= len(totals)):
+            raise Exception("oops; margin labels must index into its totals")
+        if (totals < 0).any():
+            raise Exception("oops; margin totals must be non-negative")
+        sizes = np.bincount(labels, minlength=len(totals))
+        if ((sizes == 0) & (totals != 0)).any():
+            raise Exception("oops; some margin groups have a positive total but no cells")
+        out.append((labels, totals))
+        grand_totals.append(totals.sum())
+
+    if grand_totals and not np.allclose(grand_totals, grand_totals[0], rtol=1e-9, atol=1e-6):
+        raise Exception("oops; margins are inconsistent, their totals sum to " + str(grand_totals))
+    return out
+
+def _cg(matvec, rhs, max_iter, inv_diag):
+    """ Jacobi-preconditioned conjugate gradient for a symmetric positive (semi-)definite system
+    """
+    x = np.zeros_like(rhs)
+    r = rhs.copy()
+    z = inv_diag * r
+    p = z.copy()
+    rz = r @ z
+    stop = 1e-20 + 1e-2 * (r @ r) # a rough direction is enough for Newton
+    for i in range(max_iter):
+        if r @ r <= stop:
+            break
+        Ap = matvec(p)
+        alpha = rz / (p @ Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        z = inv_diag * r
+        rz, rz_old = r @ z, rz
+        p = z + (rz / rz_old) * p
+    return x
@@ -3,29 +3,41 @@ import sys, os
 import time, datetime
 import random
 import matplotlib.pyplot as plt
-import pyomo.environ
-from pyomo.core import *
-from pyomo.opt import SolverFactory
 
-def GDPC(eps, exact_counts):
+from projection import *
+from noise import two_sided_geometric, keyed_two_sided_geometric
+from sim_store import SimStore
+
+def GDPC(eps, exact_counts, rng=None, run_seed=None, geokeys=None, cell_keys=0, stream=0):
         """ Geometric DP Counts
         Parameters
         ----------
-        eps : float-able
+        eps : float-able; noise is P(k) proportional to exp(-eps*|k|)
         exact_counts : pd.Series
+        rng : np.random.Generator; defaults to the global np.random state
+        run_seed : if set, noise is keyed by (run_seed, geokeys, cell_keys, stream) instead of
+                   drawn from rng, so it doesn't depend on order or chunking (see noise)
+        geokeys : int geography key per count; defaults to exact_counts.index (or positions)
+        cell_keys : uint64 cell key per count, or one shared by all
+        stream : int, for independent noise on the same cells
         
         Results
         -------
         returns dp_counts, a pd.Series with index matching exact_counts"""
         
         z = float(eps)
+        rng = np.random if rng is None else rng
 
-        all_errors = (np.random.geometric(z, size=len(exact_counts))
-                        - np.random.geometric(z, size=len(exact_counts)))
+        if run_seed is not None:
+            if geokeys is None:
+                geokeys = getattr(exact_counts, 'index', np.arange(len(exact_counts)))
+            all_errors = keyed_two_sided_geometric(z, run_seed, geokeys, cell_keys, stream)
+        else:
+            all_errors = two_sided_geometric(z, size=len(exact_counts), rng=rng)
         dp_counts = exact_counts + all_errors
         return dp_counts
 
-def nonnegative_optimize(imprecise_counts, control_total):
+def nonnegative_optimize(imprecise_counts, control_total, backend='numpy'):
     """optimize the imprecise counts so that they sum to
     the control total and are non-negative
     
@@ -33,29 +45,17 @@ def nonnegative_optimize(imprecise_counts, control_total):
     ----------
     imprecise_counts : list-like of floats
     control_total : float
+    backend : 'numpy' for the exact simplex projection,
+              'ipopt' to solve with pyomo/ipopt for cross-checking
     
     Results
     -------
     returns optimized_counts, which are close to imprecise counts,
     but not negative, and match control total in aggregate
     """
-    imprecise_counts = list(imprecise_counts)
-    
-    model = ConcreteModel()
-    model.I = range(len(imprecise_counts))
-    model.x = Var(model.I, within=NonNegativeReals)
-    model.objective = Objective(
-        expr=sum((model.x[i] - imprecise_counts[i])**2 for i in model.I))
-    model.constraint = Constraint(
-        expr=summation(model.x) == control_total)
-    
-    solver = SolverFactory('ipopt')
-    results = solver.solve(model, options={'acceptable_tol':1e-4}, tee=False)
-    optimized_counts = [value(model.x[i]) for i in model.I]
-        
-    return np.array(optimized_counts)
+    return nonneg_project(imprecise_counts, control_total, backend=backend)
 
-def main(a, b, pct_minority, segregation_factor, K, N, epsilon, seed):
+def main(a, b, pct_minority, segregation_factor, K, N, epsilon, seed, backend='numpy', store=None):
     """ run full algorithm to add geometric noise then optimize to remove negatives
     over a population with minority and majority subpopulations
     for which the minority pop is in the majority in some "counties"
@@ -67,42 +67,227 @@ def main(a, b, pct_minority, segregation_factor, K, N, epsilon, seed):
     pct_minority = pct of population in the minority
     K = total population size
     epsilon = parameter for amount of privacy in overall counts
+    seed = int, np.random.SeedSequence or np.random.Generator; all draws come from it
+    backend = post-processing backend, see nonnegative_optimize
+    store = optional SimStore (or its path) to append this run's summary row to
     
     Output
     ------
-    array with:
+    SimResult (indexes and unpacks like the old list) with:
     which areas were originally minority majority, minority minority
     precise minority counts, precise majority counts
     dp minority counts, dp majority counts
     nn minority counts, nn majority counts
     """
-    n_k = np.random.beta(a, b, K) # number of individuals in area k
+    rng = np.random.default_rng(seed)
+    n_k = rng.beta(a, b, K) # number of individuals in area k
     n_k *= N/sum(n_k)
     total_pop = sum(n_k)
 
-    minority_share = np.random.beta(pct_minority/segregation_factor,
-                                    (1-pct_minority)/segregation_factor, size=K)
+    minority_share = rng.beta(pct_minority/segregation_factor,
+                              (1-pct_minority)/segregation_factor, size=K)
     minmaj_area = minority_share >= 0.5
     minmin_area = minority_share < 0.5
     # simulate race-/location-stratified counts
-    precise_minority_count = np.random.binomial(n_k.astype(int), minority_share)
+    precise_minority_count = rng.binomial(n_k.astype(int), minority_share)
     precise_majority_count = n_k - precise_minority_count
 
     # add Geometric noise, to make counts differentially private
-    dp_minority_count = GDPC(epsilon, precise_minority_count)
-    dp_majority_count = GDPC(epsilon, precise_majority_count)
+    dp_minority_count = GDPC(epsilon, precise_minority_count, rng=rng)
+    dp_majority_count = GDPC(epsilon, precise_majority_count, rng=rng)
 
     # optimize to find counts that are "close" to the dp counts,
     # are non-negative, and have race-stratified sums that match the precise
     # total sum for both minority and majority groups
 
-    nn_minority_count = nonnegative_optimize(dp_minority_count, precise_minority_count.sum())
-    nn_majority_count = nonnegative_optimize(dp_majority_count, precise_majority_count.sum())
+    nn_minority_count = nonnegative_optimize(dp_minority_count, precise_minority_count.sum(), backend=backend)
+    nn_majority_count = nonnegative_optimize(dp_majority_count, precise_majority_count.sum(), backend=backend)
 
-    return[minmaj_area,minmin_area,
-           precise_minority_count,precise_majority_count,
-           dp_minority_count,dp_majority_count,
-           nn_minority_count,nn_majority_count]
+    out = SimResult(minmaj_area,minmin_area,
+                    precise_minority_count,precise_majority_count,
+                    dp_minority_count,dp_majority_count,
+                    nn_minority_count,nn_majority_count)
+    if store is not None:
+        summaries(out, store=store, params=dict(a=a, b=b, pct_minority=pct_minority,
+                                                segregation_factor=segregation_factor,
+                                                K=K, N=N, epsilon=epsilon))
+    return out
+
+class SimResult(object):
+    ''' main's eight outputs; also indexes, slices and unpacks like the list main used to return
+    '''
+    __slots__ = ['minmaj_area', 'minmin_area',
+                 'precise_minority_count', 'precise_majority_count',
+                 'dp_minority_count', 'dp_majority_count',
+                 'nn_minority_count', 'nn_majority_count']
+    
+    def __init__(self, *values):
+        if len(values) != len(self.__slots__):
+            raise Exception("oops; SimResult takes " + str(len(self.__slots__)) + " arrays")
+        for name, val in zip(self.__slots__, values):
+            setattr(self, name, val)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [getattr(self, name) for name in self.__slots__[i]]
+        return getattr(self, self.__slots__[i])
+    
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+    
+    def __len__(self):
+        return len(self.__slots__)
+    
+    def stats(self):
+        """ summary_stats of the minority counts
+        """
+        return summary_stats(self.minmaj_area, self.precise_minority_count,
+                             self.dp_minority_count, self.nn_minority_count)
+
+def summary_stats(minmaj_area, precise, dp, nn):
+    """ counts, totals and means of minority counts in both area classes, without masked copies:
+    the minority majority total is a dot product with the area mask, the other class is the rest
+    
+    Parameters
+    ----------
+    minmaj_area : bool array, (counties,) for one run or (trials, counties) for a batch
+    precise, dp, nn : minority counts shaped like minmaj_area
+    
+    Output
+    ------
+    dict with n_<area>, precise_<area>, dp_<area>, nn_<area>, pct_change_<area> and
+    mean_precise_<area>, mean_dp_<area>, mean_nn_<area> for area in minmaj, minmin;
+    scalars for one run, (trials,) arrays for a batch
+    """
+    minmaj_area = np.asarray(minmaj_area, dtype=bool)
+    batch = minmaj_area.ndim == 2
+    mask = np.atleast_2d(minmaj_area).view(np.int8)
+    
+    # column 0 = minority minority areas, 1 = minority majority areas
+    n_minmaj = mask.sum(axis=1)
+    n = np.stack([mask.shape[1] - n_minmaj, n_minmaj], axis=1)
+    sums = {}
+    for name, x in [('precise', precise), ('dp', dp), ('nn', nn)]:
+        x = np.atleast_2d(np.asarray(x))
+        minmaj = np.einsum('tk,tk->t', x, mask)
+        sums[name] = np.stack([x.sum(axis=1) - minmaj, minmaj], axis=1)
+    
+    out = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for j, area in [(1, 'minmaj'), (0, 'minmin')]:
+            out['n_' + area] = n[:, j]
+            for name in ['precise', 'dp', 'nn']:
+                out[name + '_' + area] = sums[name][:, j]
+                out['mean_' + name + '_' + area] = sums[name][:, j] / n[:, j]
+            out['pct_change_' + area] = 1 - sums['nn'][:, j] / sums['dp'][:, j]
+    if not batch:
+        out = {k: v[0] for k, v in out.items()}
+    return out
+
+GRID_COLS = ['a', 'b', 'pct_minority', 'segregation_factor', 'K', 'N', 'epsilon']
+SUMMARY_COLS = [i + '_' + area for area in ['minmaj', 'minmin']
+                for i in ['n', 'precise', 'dp', 'nn', 'pct_change']]
+
+# the columns every writer (main / summaries, main_batch, sweep) puts in a store, so they can share one,
+# with fixed dtypes so e.g. epsilon=1 then epsilon=0.5 are both stored as floats
+STORE_COLS = GRID_COLS + SUMMARY_COLS
+STORE_DTYPES = dict({i: 'float64' for i in STORE_COLS}, K='int64', N='int64')
+
+def open_store(store):
+    """ a SimStore keyed by GRID_COLS, from a path or an already open store
+    """
+    return SimStore(store, param_cols=GRID_COLS, dtypes=STORE_DTYPES) if isinstance(store, str) else store
+
+def append_to_store(store, df, batch_id=None):
+    """ append the STORE_COLS of df (a main_batch frame, or summaries' row) to a store;
+    config and replicate are left out, the store aggregates by the GRID_COLS values themselves
+    """
+    missing = [i for i in STORE_COLS if i not in df.columns]
+    if missing:
+        raise Exception("oops; results are missing store columns " + str(missing))
+    return open_store(store).append(df[STORE_COLS], batch_id=batch_id)
+
+def main_batch(grid, n_reps, seed=None, max_cells=2e7, backend='numpy', store=None):
+    """ run main for every row of a parameter grid, n_reps times each,
+    as 2-d (trials x counties) arrays instead of one call per run
+    
+    Parameters
+    ----------
+    grid : pd.DataFrame (or list of dicts) with columns GRID_COLS
+    n_reps : number of replicates per grid row
+    seed : int, np.random.SeedSequence or np.random.Generator
+    max_cells : upper bound on trials x counties held in memory at once
+    backend : post-processing backend, see nonnegative_optimize
+    store : optional SimStore (or its path) to append the results to
+    
+    Output
+    ------
+    pd.DataFrame with one row per trial: the grid params, replicate number,
+    minority totals for {precise, dp, nn} x {minority majority areas, min min areas},
+    and majority totals over all areas (precise_majority, dp_majority, nn_majority)
+    
+    With n_reps = 1 and one grid row, the draws match main's for the same seed
+    """
+    grid = pd.DataFrame(grid)
+    missing = [i for i in GRID_COLS if i not in grid.columns]
+    if missing:
+        raise Exception("oops; grid is missing columns " + str(missing))
+    grid = grid[GRID_COLS].reset_index(drop=True)
+    rng = np.random.default_rng(seed)
+    
+    # one row per trial; trials with the same K can share a 2-d array
+    trials = grid.loc[grid.index.repeat(n_reps)].rename_axis('config').reset_index()
+    trials['replicate'] = np.tile(np.arange(n_reps), len(grid))
+    
+    out = []
+    for K, group in trials.groupby('K', sort=False):
+        K = int(K)
+        step = max(1, int(max_cells // K))
+        for start in range(0, len(group), step):
+            block = group.iloc[start:start + step]
+            out.append(_run_block(block, K, rng, backend))
+    
+    out = pd.concat(out).sort_values(['config','replicate']).reset_index(drop=True)
+    if store is not None:
+        append_to_store(store, out)
+    return out
+
+def _run_block(block, K, rng, backend):
+    """ simulate and summarize one block of trials sharing K
+    """
+    col = lambda name: block[name].to_numpy(dtype=float)[:, None]
+    T = len(block)
+    
+    n_k = rng.beta(col('a'), col('b'), size=(T, K)) # number of individuals in area k
+    n_k *= col('N')/n_k.sum(axis=1, keepdims=True)
+    
+    minority_share = rng.beta(col('pct_minority')/col('segregation_factor'),
+                              (1-col('pct_minority'))/col('segregation_factor'), size=(T, K))
+    minmaj_area = minority_share >= 0.5
+    precise_minority_count = rng.binomial(n_k.astype(int), minority_share)
+    precise_majority_count = n_k - precise_minority_count
+    
+    # geometric noise, drawn for every trial at once
+    eps = col('epsilon')
+    dp_minority_count = precise_minority_count + two_sided_geometric(eps, size=(T, K), rng=rng)
+    dp_majority_count = precise_majority_count + two_sided_geometric(eps, size=(T, K), rng=rng)
+    
+    # row-wise non-negative projection onto each trial's precise totals, for both groups as in main
+    if backend == 'numpy':
+        project = lambda dp, precise: project_simplex(dp, precise.sum(axis=1))
+    else:
+        project = lambda dp, precise: np.array([nonnegative_optimize(dp[i], precise[i].sum(), backend=backend)
+                                                for i in range(T)])
+    nn_minority_count = project(dp_minority_count, precise_minority_count)
+    nn_majority_count = project(dp_majority_count, precise_majority_count)
+    
+    res = block.copy()
+    stats = summary_stats(minmaj_area, precise_minority_count, dp_minority_count, nn_minority_count)
+    for col in SUMMARY_COLS:
+        res[col] = stats[col]
+    for name, x in [('precise', precise_majority_count), ('dp', dp_majority_count), ('nn', nn_majority_count)]:
+        res[name + '_majority'] = x.sum(axis=1)
+    return res
 
 def see_minmaj_distr(main_obj, version, use_log = False):
     """ Plot minority counts
@@ -138,39 +323,32 @@ def see_minmaj_distr(main_obj, version, use_log = False):
     plt.show()
     plt.close()
 
-def summaries(main_obj):
+def summaries(main_obj, store=None, params=None):
     """     
     Parameters
     ----------
     output array of "main"
+    store : optional SimStore (or its path) to append a row of STORE_COLS to,
+            as main_batch does
+    params : dict of GRID_COLS values for the row, needed with store
     
     Output
     ------
     Table with summaries of total counts for
     {precise, dp, nn} x {minority majority areas, min min areas}
     """
-    #grab outputs
-    minmaj_area,minmin_area = main_obj[0], main_obj[1]
-    precise_minority_count,precise_majority_count = main_obj[2], main_obj[3]
-    dp_minority_count,dp_majority_count = main_obj[4], main_obj[5]
-    nn_minority_count,nn_majority_count = main_obj[6], main_obj[7]
-    
-    # get stats
-    minmaj_count, minmin_count = minmaj_area.sum(), minmin_area.sum()
-    
-    precise_total_minmaj, precise_mean_minmaj = precise_minority_count[minmaj_area].sum(), precise_minority_count[minmaj_area].sum()/minmaj_count
-    dp_total_minmaj, dp_mean_minmaj = dp_minority_count[minmaj_area].sum(), dp_minority_count[minmaj_area].sum()/minmaj_count
-    nn_total_minmaj, nn_mean_minmaj = nn_minority_count[minmaj_area].sum(), nn_minority_count[minmaj_area].sum()/minmaj_count
-    minmaj_change = 1-(nn_total_minmaj/dp_total_minmaj)
+    # one fused pass over the minority counts (see summary_stats)
+    s = summary_stats(main_obj[0], main_obj[2], main_obj[4], main_obj[6])
     
-    precise_total_minmin, precise_mean_minmin = precise_minority_count[minmin_area].sum(), precise_minority_count[minmin_area].sum()/minmin_count
-    dp_total_minmin, dp_mean_minmin = dp_minority_count[minmin_area].sum(), dp_minority_count[minmin_area].sum()/minmin_count
-    nn_total_minmin, nn_mean_minmin = nn_minority_count[minmin_area].sum(), nn_minority_count[minmin_area].sum()/minmin_count
-    minmin_change = 1-(nn_total_minmin/dp_total_minmin)
+    if store is not None:
+        if params is None:
+            raise Exception("oops; pass params with store")
+        row = dict(params, **{i: s[i] for i in SUMMARY_COLS})
+        append_to_store(store, pd.DataFrame([row]))
     
     #compile table
     summary = pd.DataFrame(columns=['precise','dp ','non-neg','pct change'],
                            index=["minority majority totals","minority minority totals"],
-                           data = [[precise_total_minmaj,dp_total_minmaj,nn_total_minmaj,minmaj_change],
-                     [precise_total_minmin,dp_total_minmin,nn_total_minmin,minmin_change]])
+                           data = [[s['precise_minmaj'],s['dp_minmaj'],s['nn_minmaj'],s['pct_change_minmaj']],
+                     [s['precise_minmin'],s['dp_minmin'],s['nn_minmin'],s['pct_change_minmin']]])
     return summary.T
\ No newline at end of file
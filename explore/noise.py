@@ -0,0 +1,139 @@
+import pandas as pd, numpy as np
+
+"""Goal: DP noise that depends only on (run seed, geography, cell), not on how the data is chunked.
+
+Each cell's noise comes from one call of the Philox4x32-10 counter-based generator with
+    counter = (geokey low 32 bits, geokey high 32 bits, cell key low 32 bits, cell key high 32 bits)
+    key     = (run_seed, stream)
+so any subset of cells, in any order, on any worker, gets bit-identical noise, and one block's
+noise can be re-derived without regenerating the whole state. Cell keys are stable 64-bit
+hashes of the cell's characteristics (see cell_keys); use a different stream for each
+independent draw on the same cells (e.g. minority and majority counts).
+
+two_sided_geometric is the geometric mechanism's noise, P(k) proportional to exp(-eps*|k|),
+drawn exactly by inverse CDF from one uniform per value.
+"""
+
+PHILOX_M = (np.uint64(0xD2511F53), np.uint64(0xCD9E8D57))
+PHILOX_W = (0x9E3779B9, 0xBB67AE85)
+MASK32 = np.uint64(0xFFFFFFFF)
+
+def philox4x32(counter, key, rounds = 10):
+    """ vectorized Philox4x32 (Salmon et al. 2011, Random123)
+
+    Parameters
+    ----------
+    counter : 4 array-likes of uint32 words (broadcastable)
+    key : 2 ints in [0, 2**32)
+
+    Results
+    -------
+    returns 4 uint32 np.arrays
+    """
+    c0, c1, c2, c3 = np.broadcast_arrays(*[np.asarray(i).astype(np.uint64) & MASK32 for i in counter])
+    k0, k1 = int(key[0]) & 0xFFFFFFFF, int(key[1]) & 0xFFFFFFFF
+    for r in range(rounds):
+        p0 = c0 * PHILOX_M[0]
+        p1 = c2 * PHILOX_M[1]
+        c0, c1, c2, c3 = ((p1 >> np.uint64(32)) ^ c1 ^ np.uint64(k0), p1 & MASK32,
+                          (p0 >> np.uint64(32)) ^ c3 ^ np.uint64(k1), p0 & MASK32)
+        k0, k1 = (k0 + PHILOX_W[0]) & 0xFFFFFFFF, (k1 + PHILOX_W[1]) & 0xFFFFFFFF
+    return tuple(i.astype(np.uint32) for i in (c0, c1, c2, c3))
+
+def cell_keys(df, cols = None):
+    """ stable uint64 key per row from the values in cols, e.g. ['race','sex_id','a1_start'];
+        the same values (with the same dtypes) give the same key in every run and every chunk
+    """
+    cols = list(df.columns) if cols is None else list(cols)
+    if not cols:
+        return np.zeros(len(df), dtype=np.uint64)
+    return pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+
+def geo_keys(geoids):
+    """ int64 keys for a geography column: int geokeys pass through, GEOID digit strings are
+        parsed, so '530010950011001' and its geokey get the same noise
+    """
+    return pd.Series(geoids, copy=False).astype(np.int64).to_numpy()
+
+def keyed_uniforms(run_seed, geokeys, cell_keys = 0, stream = 0):
+    """ two independent arrays of uniforms on the open interval (0, 1), one value per cell
+
+    Parameters
+    ----------
+    run_seed : int in [0, 2**32)
+    geokeys : array-like of int64 geography keys
+    cell_keys : array-like of uint64 cell keys (or a scalar shared by every cell)
+    stream : int in [0, 2**32), for independent draws on the same cells
+
+    Results
+    -------
+    returns (u0, u1), float64 np.arrays shaped like the broadcast of geokeys and cell_keys
+    """
+    if not 0 <= int(run_seed) < 2**32 or not 0 <= int(stream) < 2**32:
+        raise ValueError("run_seed and stream must be in [0, 2**32)")
+    g = np.asarray(geokeys, dtype=np.int64).view(np.uint64) if np.ndim(geokeys) else np.uint64(np.int64(geokeys))
+    c = np.asarray(cell_keys).astype(np.uint64)
+    x0, x1, x2, x3 = philox4x32((g, g >> np.uint64(32), c, c >> np.uint64(32)), (run_seed, stream))
+
+    # top 53 bits of each 64-bit half, offset half a step so 0 and 1 never come up
+    def to_unit(hi, lo):
+        bits = (hi.astype(np.uint64) << np.uint64(32)) | lo.astype(np.uint64)
+        return ((bits >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0**-53
+    return to_unit(x0, x1), to_unit(x2, x3)
+
+def keyed_laplace(scale, run_seed, geokeys, cell_keys = 0, stream = 0):
+    """ Laplace(0, scale) noise per cell, by inverse CDF of one keyed uniform
+    """
+    u = keyed_uniforms(run_seed, geokeys, cell_keys, stream)[0] - 0.5
+    return -scale * np.sign(u) * np.log1p(-2*np.abs(u))
+
+def keyed_two_sided_geometric(eps, run_seed, geokeys, cell_keys = 0, stream = 0, out = None):
+    """ two_sided_geometric noise per cell from one keyed uniform
+    """
+    u = keyed_uniforms(run_seed, geokeys, cell_keys, stream)[0]
+    return _two_sided_geometric_from_uniforms(u, eps, out)
+
+def two_sided_geometric(eps, size = None, rng = None, out = None):
+    """ two-sided geometric noise, P(k) = (1-a)/(1+a) * a**|k| with a = exp(-eps)
+
+    Parameters
+    ----------
+    eps : float or array broadcastable to size, e.g. shape (trials, 1) for per-trial epsilons
+    size : output shape; defaults to out.shape, or eps's shape
+    rng : np.random.Generator; defaults to the global np.random state
+    out : optional int array to write the noise into
+
+    Results
+    -------
+    returns out, or a new int64 np.array
+    """
+    rng = np.random if rng is None else rng
+    if size is None:
+        size = out.shape if out is not None else np.shape(eps)
+    return _two_sided_geometric_from_uniforms(rng.random(size), eps, out)
+
+def _two_sided_geometric_from_uniforms(u, eps, out = None):
+    """ inverse CDF; overwrites u, which must be a float64 array
+
+        with a = exp(-eps), P(X <= -1) = a/(1+a) and for m >= 1
+            P(X <= -m) = a**m/(1+a),  P(X >= m) = a**m/(1+a)
+        so X = -floor(log(u(1+a))/log a) for u <= a/(1+a), else floor(log((1-u)(1+a))/log a)
+    """
+    eps = np.asarray(eps, dtype=np.float64)
+    if (eps <= 0).any():
+        raise ValueError("eps must be positive")
+    alpha = np.exp(-eps)
+    np.maximum(u, 2.0**-54, out=u) # rng.random can return exactly 0
+
+    lower = u <= alpha/(1 + alpha)
+    np.subtract(1, u, out=u, where=~lower)
+    u *= 1 + alpha
+    np.log(u, out=u)
+    u /= -eps
+    np.floor(u, out=u)
+    np.negative(u, out=u, where=lower)
+
+    if out is None:
+        return u.astype(np.int64)
+    out[...] = u
+    return out
@@ -0,0 +1,197 @@
+import pandas as pd, numpy as np
+import os, json, hashlib, shutil, time, uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+"""Goal: parse each big source csv (ACS PUMS, decennial DHC) once, then read it back as parquet.
+
+The first read of a csv writes it to a cache entry; later reads go through pyarrow with
+column and row-group (and partition) pushdown. An entry is keyed by the csv path, its mtime
+and size, and the column selection, so editing the source or asking for other columns makes
+a new entry. Entries live under
+    <cache_dir>/<partition dirs, e.g. state=WA/year=2016>/<file name>-<key>/
+and the least recently used ones are evicted once the cache is over max_cache_bytes.
+Without pyarrow everything falls back to plain pd.read_csv.
+"""
+
+cache_dir = os.environ.get('CENSUS_DP_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'explore_census_2020_dp'))
+max_cache_bytes = int(float(os.environ.get('CENSUS_DP_CACHE_MAX_BYTES', 50e9)))
+row_group_size = 1_000_000
+# parsed rows wait in memory until there are row_group_size of them or they take this many bytes
+row_group_bytes = 256 << 20
+
+def cache_key(path, usecols=None, dtype=None, partition_cols=None):
+    """ hash of path + mtime + size + column selection (+ the parse options that change the entry)
+    """
+    st = os.stat(path)
+    payload = json.dumps({'path': os.path.abspath(path),
+                          'mtime_ns': st.st_mtime_ns,
+                          'size': st.st_size,
+                          'usecols': sorted(usecols) if usecols is not None else None,
+                          'dtype': {k: str(v) for k, v in sorted((dtype or {}).items())},
+                          'partition_cols': partition_cols})
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+def cached_read_csv(path, usecols=None, dtype=None, columns=None, filters=None,
+                    partition_values=None, partition_cols=None, chunksize=None, use_cache=True):
+    """ read a csv through the parquet cache
+
+    Parameters
+    ----------
+    path : csv path
+    usecols, dtype : passed to pd.read_csv when the entry is built; usecols is part of the key
+    columns : columns to read back (column pushdown)
+    filters : pyarrow filters, e.g. [('STATE', '==', 53)] (row-group / partition pushdown)
+    partition_values : dict like {'state':'WA', 'year':2016} for a source that is one partition
+    partition_cols : columns to hive-partition a multi-partition source on, e.g. ['STATE']
+    chunksize : if set, build the entry chunk by chunk so the csv never sits in memory whole;
+                pass dtype too, so every chunk gets the same schema. Chunks are gathered into
+                row groups of up to row_group_size rows, so at most row_group_bytes of parsed
+                rows are held besides the chunk being parsed
+    use_cache : False (or no pyarrow) reads the csv directly
+
+    Results
+    -------
+    returns a pd.DataFrame
+    """
+    if pa is None or not use_cache:
+        return _read_csv_direct(path, usecols, dtype, columns, filters)
+
+    entry = _ensure_entry(path, usecols, dtype, partition_values, partition_cols, chunksize)
+    table = pq.read_table(os.path.join(entry, 'data'), columns=columns, filters=filters)
+    return table.to_pandas()
+
+def cached_read_csv_chunks(path, usecols=None, dtype=None, columns=None, filters=None,
+                           partition_values=None, partition_cols=None, chunksize=100_000, use_cache=True):
+    """ like cached_read_csv, but yields DataFrames of at most chunksize rows; a first read
+    parses the csv chunksize rows at a time to build the entry
+    """
+    if pa is None or not use_cache:
+        for df in pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize):
+            yield _apply_filters(df, filters)[columns] if columns is not None else _apply_filters(df, filters)
+        return
+
+    entry = _ensure_entry(path, usecols, dtype, partition_values, partition_cols, chunksize)
+    dataset = ds.dataset(os.path.join(entry, 'data'), format='parquet', partitioning='hive')
+    expr = pq.filters_to_expression(filters) if filters else None
+    for batch in dataset.to_batches(columns=columns, filter=expr, batch_size=chunksize):
+        if batch.num_rows > 0:
+            yield batch.to_pandas()
+
+def evict(max_bytes=None, keep=None):
+    """ delete least recently used entries until the cache is under max_bytes;
+    the entry dir given as keep is never deleted
+    """
+    max_bytes = max_cache_bytes if max_bytes is None else max_bytes
+    entries = []
+    for root, dirs, files in os.walk(cache_dir):
+        if '_SUCCESS' in files:
+            entries.append((os.path.getmtime(os.path.join(root, '_SUCCESS')), _dir_size(root), root))
+            dirs[:] = []
+        else:
+            # leftovers of builds that were killed part way
+            stale = [i for i in dirs if i.startswith('.tmp-')
+                     and time.time() - os.path.getmtime(os.path.join(root, i)) > 24*3600]
+            for i in stale:
+                shutil.rmtree(os.path.join(root, i), ignore_errors=True)
+            dirs[:] = [i for i in dirs if not i.startswith('.tmp-')]
+
+    total = sum(i[1] for i in entries)
+    for last_used, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+    return total
+
+def _ensure_entry(path, usecols, dtype, partition_values, partition_cols, chunksize):
+    """ return the cache entry dir for this read, building it on first use
+    """
+    parts = [str(k) + '=' + str(v) for k, v in (partition_values or {}).items()]
+    parent = os.path.join(cache_dir, *parts)
+    entry = os.path.join(parent, os.path.basename(path) + '-' + cache_key(path, usecols, dtype, partition_cols))
+
+    if not os.path.exists(os.path.join(entry, '_SUCCESS')):
+        # build in a temp dir and rename, so readers never see a partial entry
+        tmp = os.path.join(parent, '.tmp-' + uuid.uuid4().hex)
+        os.makedirs(os.path.join(tmp, 'data'))
+        try:
+            _build_entry(path, usecols, dtype, partition_cols, chunksize, os.path.join(tmp, 'data'))
+            open(os.path.join(tmp, '_SUCCESS'), 'w').close()
+            os.replace(tmp, entry)
+        except OSError:
+            # another process built it first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(entry, '_SUCCESS')):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        evict(keep=entry)
+
+    # mark as recently used for eviction
+    os.utime(os.path.join(entry, '_SUCCESS'))
+    return entry
+
+def _build_entry(path, usecols, dtype, partition_cols, chunksize, out_dir):
+    if chunksize is None:
+        chunks = [pd.read_csv(path, usecols=usecols, dtype=dtype)]
+    else:
+        chunks = pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize)
+
+    # the parse chunk only bounds memory; parsed chunks are gathered until there are enough
+    # rows for a big row group (or they get too large to hold), then written together
+    writer, schema, pending, n_flushed = None, None, [], 0
+    def flush():
+        nonlocal writer, n_flushed
+        table = pa.concat_tables(pending).combine_chunks()
+        del pending[:]
+        if partition_cols:
+            pq.write_to_dataset(table, out_dir, partition_cols=partition_cols, max_rows_per_group=row_group_size,
+                                basename_template='part-' + str(n_flushed) + '-{i}.parquet')
+        else:
+            if writer is None:
+                writer = pq.ParquetWriter(os.path.join(out_dir, 'part-0.parquet'), schema)
+            writer.write_table(table, row_group_size=row_group_size)
+        n_flushed += 1
+
+    for df in chunks:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if schema is None:
+            schema = table.schema
+        else:
+            table = table.cast(schema)
+        pending.append(table)
+        if (sum(i.num_rows for i in pending) >= row_group_size
+                or sum(i.nbytes for i in pending) >= row_group_bytes):
+            flush()
+    if pending:
+        flush()
+    if writer is not None:
+        writer.close()
+
+def _read_csv_direct(path, usecols, dtype, columns, filters):
+    df = _apply_filters(pd.read_csv(path, usecols=usecols, dtype=dtype), filters)
+    return df[columns] if columns is not None else df
+
+def _apply_filters(df, filters):
+    """ pandas equivalent of a flat list of (col, op, val) pyarrow filters
+    """
+    ops = {'==': lambda x, v: x == v, '!=': lambda x, v: x != v,
+           '<': lambda x, v: x < v, '<=': lambda x, v: x <= v,
+           '>': lambda x, v: x > v, '>=': lambda x, v: x >= v,
+           'in': lambda x, v: x.isin(v), 'not in': lambda x, v: ~x.isin(v)}
+    for col, op, val in (filters or []):
+        df = df[ops[op](df[col], val)]
+    return df
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, i)) for root, dirs, files in os.walk(path) for i in files)
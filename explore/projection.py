@@ -0,0 +1,132 @@
+import numpy as np
+
+"""Goal: post-process noisy counts so they are non-negative and sum to a control total.
+
+min_x ||x - v||^2  s.t.  x >= 0, sum(x) == total
+is the Euclidean projection of v onto the simplex scaled by total. The solution is
+x = max(v - theta, 0) for a single shift theta, which we find exactly by sorting.
+"""
+
+BACKENDS = ['numpy', 'ipopt']
+
+def project_simplex(v, total, axis=-1):
+    """ project v onto {x >= 0, sum(x) == total}, exactly, in O(n log n)
+
+    Parameters
+    ----------
+    v : array-like of floats; 1-d, or 2-d to project every row (axis=-1) independently
+    total : float, or array-like with one control total per row
+    axis : axis along which the sum constraint applies
+
+    Results
+    -------
+    returns x, a float array shaped like v
+    """
+    v = np.asarray(v, dtype=float)
+    if v.ndim == 0:
+        raise ValueError("v must have at least one dimension")
+    v = np.moveaxis(v, axis, -1)
+    n = v.shape[-1]
+    total = np.broadcast_to(np.asarray(total, dtype=float), v.shape[:-1])
+    if (total < 0).any():
+        raise ValueError("control total must be non-negative")
+    if n == 0:
+        return np.moveaxis(v.copy(), -1, axis)
+
+    # sort descending and find, per row, the largest rho with u_rho > (cumsum_rho - total) / rho
+    u = -np.sort(-v, axis=-1)
+    css = np.cumsum(u, axis=-1) - total[..., None]
+    ind = np.arange(1, n + 1)
+    cond = u * ind > css
+    cond[..., 0] = True # only fails when total == 0, where theta = max(v) is right anyway
+    rho = n - 1 - np.argmax(cond[..., ::-1], axis=-1)
+    theta = np.take_along_axis(css, rho[..., None], axis=-1) / (rho[..., None] + 1)
+
+    x = np.maximum(v - theta, 0)
+    return np.moveaxis(x, -1, axis)
+
+def project_simplex_segments(v, starts, totals):
+    """ project each contiguous segment of v onto its own scaled simplex in one pass
+
+    Parameters
+    ----------
+    v : 1-d array-like of floats
+    starts : sorted offsets where each segment begins (starts[0] must be 0);
+             repeated offsets give empty segments, which get nothing
+    totals : control total per segment
+
+    Results
+    -------
+    returns x, the concatenated per-segment projections
+    """
+    v = np.asarray(v, dtype=float)
+    starts = np.asarray(starts, dtype=np.int64)
+    totals = np.asarray(totals, dtype=float)
+    n = v.shape[0]
+    if n == 0:
+        return v.copy()
+    if starts[0] != 0 or len(starts) != len(totals):
+        raise ValueError("starts must begin at 0 and match totals in length")
+    if (totals < 0).any():
+        raise ValueError("control totals must be non-negative")
+
+    lengths = np.diff(np.append(starts, n))
+    if (lengths < 0).any():
+        raise ValueError("starts must be sorted and no larger than len(v)")
+
+    # empty segments have nothing to project, and would break the offset lookup and reduceat below
+    if (lengths == 0).any():
+        keep = lengths > 0
+        starts, totals, lengths = starts[keep], totals[keep], lengths[keep]
+    seg = np.repeat(np.arange(len(starts)), lengths)
+
+    # sort descending within segments, segments stay in order
+    order = np.lexsort((-v, seg))
+    u = v[order]
+
+    # segmented cumsum and 1-based rank within segment
+    css = np.cumsum(u)
+    offsets = np.concatenate([[0.], css[starts[1:] - 1]])
+    css = css - np.repeat(offsets, lengths) - np.repeat(totals, lengths)
+    rank = np.arange(n) - np.repeat(starts, lengths) + 1
+
+    # last index in each segment satisfying the condition (the first always counts)
+    cond_idx = np.where((u * rank > css) | (rank == 1), np.arange(n), -1)
+    rho = np.maximum.reduceat(cond_idx, starts)
+    theta = css[rho] / rank[rho]
+
+    return np.maximum(v - np.repeat(theta, lengths), 0)
+
+def ipopt_optimize(counts, control_total):
+    """ solve the same problem with a Pyomo model and the ipopt solver;
+    slow, kept so the numpy backend can be cross-checked
+    """
+    import pyomo.environ
+    from pyomo.core import ConcreteModel, Var, NonNegativeReals, Objective, Constraint, summation, value
+    from pyomo.opt import SolverFactory
+
+    counts = list(counts)
+
+    model = ConcreteModel()
+    model.I = range(len(counts))
+    model.x = Var(model.I, within=NonNegativeReals)
+    model.objective = Objective(
+        expr=sum((model.x[i] - counts[i])**2 for i in model.I))
+    model.constraint = Constraint(
+        expr=summation(model.x) == control_total)
+
+    solver = SolverFactory('ipopt')
+    results = solver.solve(model, options={'acceptable_tol':1e-4}, tee=False)
+    optimized_counts = [value(model.x[i]) for i in model.I]
+
+    return np.array(optimized_counts)
+
+def nonneg_project(counts, control_total, backend='numpy'):
+    """ dispatch to a post-processing backend: 'numpy' (exact, default) or 'ipopt'
+    """
+    if backend == 'numpy':
+        return project_simplex(np.asarray(counts, dtype=float), control_total)
+    elif backend == 'ipopt':
+        return ipopt_optimize(counts, control_total)
+    else:
+        raise Exception("oops; backend must be in " + str(BACKENDS))
@@ -0,0 +1,215 @@
+import numpy as np, pandas as pd
+import os, json
+
+"""Goal: keep simulation results in one appendable on-disk table instead of thousands of tiny csvs.
+
+A store is a directory with
+    schema.json           column dtypes, which columns are parameters / metrics, the committed
+                          row count, the batches already appended, and the current aggregates file
+    <column>.bin          raw values of each column, appended to and read back with np.memmap
+    aggregates-<n>.npz    running count / mean / M2 of every metric per parameter configuration
+Appends go to the column files first; rewriting schema.json is the commit, so a killed writer
+leaves at most some trailing bytes that the next append cuts off. Summaries per configuration
+come from the aggregates file alone, without re-reading the rows. One writer at a time.
+"""
+
+class SimStore(object):
+    ''' appendable columnar store of simulation results with running per-configuration aggregates
+    '''
+    def __init__(self, path, param_cols = None, metric_cols = None, dtypes = None):
+        """
+        Parameters
+        ----------
+        path : store directory; created on the first append if it doesn't exist
+        param_cols : columns that identify a configuration, e.g. min_majority_fns.GRID_COLS
+        metric_cols : columns to keep running aggregates of; defaults to every column that is
+                      not a parameter, 'config' or 'replicate'
+        dtypes : dict column -> dtype for a new store, e.g. float64 for parameters that callers
+                 may pass as 1 or 0.5; other columns take the dtype of the first append
+        """
+        self.path = path
+        schema_path = os.path.join(path, 'schema.json')
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                self.schema = json.load(f)
+            for name, given in [('param_cols', param_cols), ('metric_cols', metric_cols)]:
+                if given is not None and list(given) != self.schema[name]:
+                    raise Exception("oops; " + path + " was made with " + name + " " + str(self.schema[name]))
+        else:
+            if param_cols is None:
+                raise Exception("oops; a new store needs param_cols")
+            self.schema = {'columns': None, 'param_cols': list(param_cols),
+                           'metric_cols': None if metric_cols is None else list(metric_cols),
+                           'n_rows': 0, 'batches': [], 'aggregates': None}
+        self.dtypes = {i: str(np.dtype(t)) for i, t in (dtypes or {}).items()}
+
+    def __len__(self):
+        return self.schema['n_rows']
+
+    @property
+    def columns(self):
+        return list(self.schema['columns'] or {})
+
+    def append(self, df, batch_id = None):
+        """ append the rows of df and fold them into the aggregates
+
+        Parameters
+        ----------
+        df : pd.DataFrame with the store's columns (the first append fixes them and their dtypes)
+        batch_id : optional str/int naming this batch; a batch that is already in the store is
+                   skipped, so re-running an interrupted job doesn't double count
+
+        Results
+        -------
+        returns the number of rows appended
+        """
+        if batch_id is not None and self.has_batch(batch_id):
+            return 0
+        df = pd.DataFrame(df).reset_index(drop=True)
+        if self.schema['columns'] is None:
+            self._init_columns(df)
+        missing = [i for i in self.columns if i not in df.columns]
+        if missing:
+            raise Exception("oops; df is missing store columns " + str(missing))
+        values = {col: _exact_cast(df[col], dtype) for col, dtype in self.schema['columns'].items()}
+
+        # cut off anything a killed writer left past the committed rows, then append
+        n = self.schema['n_rows']
+        for col, dtype in self.schema['columns'].items():
+            with open(self._col_path(col), 'ab') as f:
+                f.truncate(n * np.dtype(dtype).itemsize)
+                np.ascontiguousarray(values[col]).tofile(f)
+
+        agg = self._merge_aggregates(self._load_aggregates(), df)
+        agg_file = 'aggregates-{}.npz'.format(n + len(df))
+        np.savez(os.path.join(self.path, agg_file), **agg)
+
+        old_agg = self.schema['aggregates']
+        self.schema['n_rows'] = n + len(df)
+        self.schema['aggregates'] = agg_file
+        if batch_id is not None:
+            self.schema['batches'].append(str(batch_id))
+        self._write_schema()
+        if old_agg is not None and old_agg != agg_file:
+            os.remove(os.path.join(self.path, old_agg))
+        return len(df)
+
+    def has_batch(self, batch_id):
+        return str(batch_id) in self.schema['batches']
+
+    def column(self, col):
+        """ read-only np.memmap of one column's committed rows
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=self.schema['columns'][col])
+        return np.memmap(self._col_path(col), dtype=self.schema['columns'][col], mode='r', shape=(len(self),))
+
+    def read(self, columns = None):
+        """ the committed rows as a pd.DataFrame
+        """
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({i: np.array(self.column(i)) for i in columns})
+
+    def aggregates(self):
+        """ per-configuration count, mean and (sample) variance of every metric,
+            read from the aggregates file without touching the rows
+
+        Results
+        -------
+        returns a pd.DataFrame with the param columns, count, and mean_<metric>, var_<metric>
+        """
+        agg = self._load_aggregates()
+        params = self.schema['param_cols']
+        out = pd.DataFrame(agg['keys'], columns=params)
+        if self.schema['columns'] is not None:
+            out = out.astype({i: self.schema['columns'][i] for i in params})
+        out['count'] = agg['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = agg['m2'] / (agg['count'][:, None] - 1)
+        for j, metric in enumerate(self.schema['metric_cols'] or []):
+            out['mean_' + metric] = agg['mean'][:, j]
+            out['var_' + metric] = np.where(agg['count'] > 1, var[:, j], np.nan)
+        return out
+
+    def _init_columns(self, df):
+        types = {}
+        for col in df.columns:
+            kind = df[col].dtype.kind
+            if kind not in 'biuf':
+                raise Exception("oops; store columns must be numeric or bool, " + col + " is " + str(df[col].dtype))
+            types[col] = self.dtypes.get(col, str(df[col].dtype))
+        missing = [i for i in self.schema['param_cols'] if i not in types]
+        if missing:
+            raise Exception("oops; df is missing param columns " + str(missing))
+        if self.schema['metric_cols'] is None:
+            self.schema['metric_cols'] = [i for i in types if i not in self.schema['param_cols']
+                                          and i not in ('config', 'replicate')]
+        self.schema['columns'] = types
+        os.makedirs(self.path, exist_ok=True)
+
+    def _load_aggregates(self):
+        p, m = len(self.schema['param_cols']), len(self.schema['metric_cols'] or [])
+        if self.schema['aggregates'] is None:
+            return {'keys': np.zeros((0, p)), 'count': np.zeros(0, dtype=np.int64),
+                    'mean': np.zeros((0, m)), 'm2': np.zeros((0, m))}
+        with np.load(os.path.join(self.path, self.schema['aggregates'])) as f:
+            return {i: f[i] for i in f.files}
+
+    def _merge_aggregates(self, agg, df):
+        """ fold df's rows into the running aggregates (Chan et al.'s pairwise update)
+        """
+        params, metrics = self.schema['param_cols'], self.schema['metric_cols']
+        if len(df) == 0:
+            return agg
+        vals = df[metrics].to_numpy(dtype=float)
+        keys, labels = np.unique(df[params].to_numpy(dtype=float), axis=0, return_inverse=True)
+        labels = labels.ravel()
+
+        # this batch's count / mean / M2 per configuration
+        n_b = np.bincount(labels, minlength=len(keys))
+        mean_b = np.zeros((len(keys), len(metrics)))
+        m2_b = np.zeros((len(keys), len(metrics)))
+        for j in range(len(metrics)):
+            mean_b[:, j] = np.bincount(labels, weights=vals[:, j], minlength=len(keys)) / n_b
+            m2_b[:, j] = np.bincount(labels, weights=(vals[:, j] - mean_b[labels, j])**2, minlength=len(keys))
+
+        # line the batch's configurations up with the stored ones, adding new ones at the end
+        index = {tuple(k): i for i, k in enumerate(agg['keys'].tolist())}
+        pos = np.array([index.get(tuple(k), -1) for k in keys.tolist()], dtype=np.int64)
+        new = pos < 0
+        pos[new] = len(agg['keys']) + np.arange(new.sum())
+        n_total = len(agg['keys']) + new.sum()
+
+        count = np.zeros(n_total, dtype=np.int64); count[:len(agg['count'])] = agg['count']
+        mean = np.zeros((n_total, len(metrics))); mean[:len(agg['mean'])] = agg['mean']
+        m2 = np.zeros((n_total, len(metrics))); m2[:len(agg['m2'])] = agg['m2']
+        out_keys = np.concatenate([agg['keys'], keys[new]])
+
+        n_a = count[pos]
+        n = n_a + n_b
+        delta = mean_b - mean[pos]
+        mean[pos] += delta * (n_b / n)[:, None]
+        m2[pos] += m2_b + delta**2 * (n_a * n_b / n)[:, None]
+        count[pos] = n
+        return {'keys': out_keys, 'count': count, 'mean': mean, 'm2': m2}
+
+    def _col_path(self, col):
+        return os.path.join(self.path, col + '.bin')
+
+    def _write_schema(self):
+        path = os.path.join(self.path, 'schema.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.schema, f)
+        os.replace(path + '.tmp', path)
+
+def _exact_cast(col, dtype):
+    """ col as dtype, raising rather than silently changing any value (e.g. 0.5 -> 0 in an int column)
+    """
+    vals = col.to_numpy()
+    out = vals.astype(dtype)
+    with np.errstate(invalid='ignore'):
+        same = (out == vals) | (pd.isna(vals) & pd.isna(out))
+    if not np.all(same):
+        raise Exception("oops; column " + str(col.name) + " holds values that can't be stored exactly as "
+                        + str(dtype) + ", e.g. " + str(vals[~same][0]))
+    return out
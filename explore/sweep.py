@@ -0,0 +1,125 @@
+import numpy as np, pandas as pd
+import os, json, hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from min_majority_fns import main_batch, GRID_COLS, open_store, append_to_store
+
+"""Goal: run minority/majority simulation grids across a local process pool.
+
+Task i is grid row i. Its Generator comes from SeedSequence(root_seed, spawn_key=(i,)),
+so any single task can be re-run on its own with run_task and give the same numbers
+no matter how many workers ran the sweep or in what order. Each finished task is
+checkpointed to out_dir/tasks/task_<i>.csv; re-running a killed sweep skips those.
+With a store (see sim_store), every task's rows also go into it, once each, as batch
+<sweep id>/<task id>; the sweep id hashes the manifest, so sweeps sharing a store don't collide.
+"""
+
+def task_seed(root_seed, task_id):
+    """ the SeedSequence for one task of a sweep
+    """
+    return np.random.SeedSequence(root_seed, spawn_key=(int(task_id),))
+
+def run_task(grid, task_id, n_reps, root_seed, backend='numpy'):
+    """ run one grid row, n_reps times, with its own deterministic Generator
+
+    Parameters
+    ----------
+    grid : pd.DataFrame with columns GRID_COLS
+    task_id : row position in grid
+    n_reps : number of replicates
+    root_seed : int seed for the whole sweep
+
+    Results
+    -------
+    returns a pd.DataFrame of n_reps rows, as from main_batch
+    """
+    grid = pd.DataFrame(grid).reset_index(drop=True)
+    rng = np.random.default_rng(task_seed(root_seed, task_id))
+    out = main_batch(grid.iloc[[task_id]], n_reps, seed=rng, backend=backend)
+    out['config'] = task_id
+    return out
+
+def run_sweep(grid, n_reps, root_seed, out_dir, n_workers=None, backend='numpy', store=None):
+    """ run every task of a grid in a process pool, resuming from checkpoints in out_dir
+
+    Parameters
+    ----------
+    grid : pd.DataFrame (or list of dicts) with columns GRID_COLS
+    n_reps : number of replicates per grid row
+    root_seed : int seed for the whole sweep
+    out_dir : directory for the sweep manifest and per-task checkpoints
+    n_workers : pool size; defaults to os.cpu_count()
+    store : optional SimStore (or its path) to append each task's results to
+
+    Results
+    -------
+    returns the results for all tasks, as from load_sweep
+    """
+    grid = pd.DataFrame(grid)[GRID_COLS].reset_index(drop=True)
+    batch = _batch_ids(_write_manifest(grid, n_reps, root_seed, out_dir, backend))
+
+    store = None if store is None else open_store(store)
+    todo = [i for i in range(len(grid)) if not os.path.exists(_task_path(out_dir, i))]
+
+    # tasks checkpointed before the store was added (or before a crash) go in first
+    if store is not None:
+        for i in range(len(grid)):
+            if i not in todo and not store.has_batch(batch(i)):
+                append_to_store(store, pd.read_csv(_task_path(out_dir, i)), batch_id=batch(i))
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(run_task, grid, i, n_reps, root_seed, backend): i for i in todo}
+            for future in as_completed(futures):
+                _write_checkpoint(future.result(), _task_path(out_dir, futures[future]))
+                if store is not None:
+                    append_to_store(store, future.result(), batch_id=batch(futures[future]))
+
+    return load_sweep(out_dir)
+
+def load_sweep(out_dir):
+    """ concatenate the checkpoints of a (possibly unfinished) sweep
+    """
+    task_dir = os.path.join(out_dir, 'tasks')
+    files = sorted(i for i in os.listdir(task_dir) if i.endswith('.csv'))
+    if not files:
+        return pd.DataFrame()
+    df = pd.concat([pd.read_csv(os.path.join(task_dir, i)) for i in files], ignore_index=True)
+    return df.sort_values(['config','replicate']).reset_index(drop=True)
+
+def _task_path(out_dir, task_id):
+    return os.path.join(out_dir, 'tasks', 'task_{:06d}.csv'.format(task_id))
+
+def _write_checkpoint(df, path):
+    # write then rename, so a killed sweep never leaves a half-written checkpoint
+    tmp = path + '.tmp'
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+def _batch_ids(manifest):
+    """ task id -> store batch id, unique to this sweep's definition
+    """
+    sweep_id = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:16]
+    return lambda task_id: sweep_id + '/' + str(task_id)
+
+def _write_manifest(grid, n_reps, root_seed, out_dir, backend='numpy'):
+    """ save the sweep definition, or check it matches the one being resumed;
+        returns the manifest as saved
+    """
+    os.makedirs(os.path.join(out_dir, 'tasks'), exist_ok=True)
+    manifest = {'n_reps': int(n_reps), 'root_seed': int(root_seed), 'backend': backend,
+                'grid': {i: grid[i].tolist() for i in grid.columns}}
+    manifest = json.loads(json.dumps(manifest))
+    path = os.path.join(out_dir, 'sweep.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            old = json.load(f)
+        # sweeps from before backend was recorded all ran with numpy
+        old.setdefault('backend', 'numpy')
+        if old != manifest:
+            raise Exception("oops; " + out_dir + " holds a different sweep; use a new out_dir")
+    else:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+    return manifest
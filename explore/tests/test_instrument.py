@@ -0,0 +1,25 @@
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import instrument
+
+def test_report_with_a_stage_nested_in_itself():
+    instrument.enable()
+    instrument.reset()
+    try:
+        @instrument.timed()
+        def countdown(n):
+            return [] if n == 0 else countdown(n - 1)
+        with instrument.stage('outer'):
+            countdown(3)
+            with instrument.stage('outer'):
+                pass
+        stages = instrument.report()
+        assert max(len(s['path']) for s in stages) == 5
+        assert ['outer'] + ['countdown'] * 4 in [s['path'] for s in stages]
+        lines = instrument.format_report().splitlines()
+        assert len(lines) == 1 + 6
+        assert lines[5].startswith('        countdown')
+    finally:
+        instrument.reset()
+        instrument.enable(False)
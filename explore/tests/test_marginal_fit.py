@@ -0,0 +1,24 @@
+import numpy as np, warnings
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from marginal_fit import fit_margins
+
+def test_fit_matches_margins_and_is_nonnegative():
+    rng = np.random.default_rng(0)
+    truth = rng.poisson(5, (20, 6)).astype(float)
+    v = truth.ravel() + rng.normal(0, 2, truth.size)
+    rows, cols = np.repeat(np.arange(20), 6), np.tile(np.arange(6), 20)
+    x = fit_margins(v, [(rows, truth.sum(1)), (cols, truth.sum(0))])
+    assert (x >= 0).all()
+    np.testing.assert_allclose(np.bincount(rows, weights=x), truth.sum(1), atol=1e-5)
+    np.testing.assert_allclose(np.bincount(cols, weights=x), truth.sum(0), atol=1e-5)
+
+def test_margin_groups_with_no_cells():
+    # group 1 of the first margin has no cells and a total of 0, as published zero-count groups do
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        x = fit_margins([1., 2., 3., -1.], [([0, 0, 2, 2], [4., 0., 3.]), ([0, 1, 0, 1], [5., 2.])])
+    assert np.isfinite(x).all() and (x >= 0).all()
+    np.testing.assert_allclose([x[0] + x[1], x[2] + x[3]], [4., 3.], atol=1e-5)
+    np.testing.assert_allclose([x[0] + x[2], x[1] + x[3]], [5., 2.], atol=1e-5)
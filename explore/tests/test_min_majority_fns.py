@@ -0,0 +1,17 @@
+import numpy as np, pandas as pd
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from min_majority_fns import main, main_batch, SUMMARY_COLS
+
+params = dict(a=1.5, b=30., pct_minority=0.1, segregation_factor=0.5, K=200, N=50_000, epsilon=0.5)
+
+def test_main_batch_matches_main_for_the_same_seed():
+    for seed in range(3):
+        run = main(seed=seed, **params)
+        batch = main_batch([params], n_reps=1, seed=seed).iloc[0]
+        stats = run.stats()
+        np.testing.assert_allclose([batch[i] for i in SUMMARY_COLS], [stats[i] for i in SUMMARY_COLS])
+        np.testing.assert_allclose([batch.precise_majority, batch.dp_majority, batch.nn_majority],
+                                   [run.precise_majority_count.sum(), run.dp_majority_count.sum(),
+                                    run.nn_majority_count.sum()])
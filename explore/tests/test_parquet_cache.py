@@ -0,0 +1,38 @@
+import numpy as np, pandas as pd, pytest
+import glob, os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import parquet_cache
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+@pytest.fixture
+def small_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(parquet_cache, 'cache_dir', str(tmp_path / 'cache'))
+    monkeypatch.setattr(parquet_cache, 'row_group_size', 50)
+    parse_sizes = []
+    read_csv = pd.read_csv
+    def spy(*args, **kwargs):
+        parse_sizes.append(kwargs.get('chunksize'))
+        return read_csv(*args, **kwargs)
+    monkeypatch.setattr(parquet_cache.pd, 'read_csv', spy)
+    df = pd.DataFrame({'STATE': np.repeat([53, 41], 100), 'x': np.arange(200.)})
+    df.to_csv(tmp_path / 'src.csv', index=False)
+    return str(tmp_path / 'src.csv'), df, parse_sizes
+
+def _row_groups(entry_glob):
+    return [pq.ParquetFile(f).metadata.row_group(i).num_rows
+            for f in sorted(glob.glob(entry_glob, recursive=True))
+            for i in range(pq.ParquetFile(f).metadata.num_row_groups)]
+
+@pytest.mark.parametrize('partition_cols', [None, ['STATE']])
+def test_chunks_parse_at_the_read_chunksize_but_write_big_row_groups(small_cache, partition_cols):
+    path, df, parse_sizes = small_cache
+    chunks = list(parquet_cache.cached_read_csv_chunks(path, dtype={'STATE': 'int64', 'x': 'float64'},
+                                                       partition_cols=partition_cols, chunksize=10))
+    assert parse_sizes == [10]
+    assert max(len(i) for i in chunks) <= 10
+    out = pd.concat(chunks).sort_values('x')
+    assert out.x.tolist() == df.x.tolist()
+    assert out.STATE.astype(int).tolist() == df.STATE.tolist()
+    assert _row_groups(os.path.join(parquet_cache.cache_dir, '**', '*.parquet')) == [50] * 4
@@ -0,0 +1,18 @@
+import numpy as np, pytest
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compare_DAS_runs'))
+from plotting_fns import Hist2D
+
+@pytest.mark.parametrize('hi', [37., 999., 123457.])
+def test_log_range_keeps_values_on_its_ends(hi):
+    hist = Hist2D((0, hi), scale = 'log').add([0, hi, hi / 2], [0, hi, hi / 3])
+    assert hist.n_outside == 0
+    assert hist.counts.sum() == 3
+    assert hist.counts[-1, -1] == 1 and hist.counts[0, 0] == 1
+
+def test_log_range_with_negative_end():
+    hist = Hist2D((-250., 4000.), bins = 50, scale = 'log').add([-250., 4000., 0.], [4000., -250., 0.])
+    assert hist.n_outside == 0
+    assert hist.x_edges[0] == -250. and hist.x_edges[-1] == 4000.
+    assert hist.add([-250.0001, 4000.0001], [0, 0]).n_outside == 2
@@ -0,0 +1,29 @@
+import numpy as np
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from projection import project_simplex, project_simplex_segments
+
+def test_segments_match_one_at_a_time():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 20, 50)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    v = rng.normal(0, 5, lengths.sum())
+    totals = rng.uniform(0, 50, len(lengths))
+    x = project_simplex_segments(v, starts, totals)
+    for s, l, t in zip(starts, lengths, totals):
+        np.testing.assert_allclose(x[s:s + l], project_simplex(v[s:s + l], t), atol=1e-10)
+
+def test_empty_segments():
+    x = project_simplex_segments([1., 2., 3.], [0, 0, 2], [1., 2., 3.])
+    np.testing.assert_allclose(x, [0.5, 1.5, 3.])
+    x = project_simplex_segments([1., 2., 3.], [0, 2, 2, 3], [2., 5., 9., 7.])
+    np.testing.assert_allclose(x, [0.5, 1.5, 9.])
+
+def test_unsorted_starts_raise():
+    try:
+        project_simplex_segments([1., 2., 3.], [0, 2, 1], [1., 1., 1.])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unsorted starts were accepted")
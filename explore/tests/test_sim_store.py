@@ -0,0 +1,54 @@
+import numpy as np, pandas as pd
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from min_majority_fns import main, main_batch, STORE_COLS, GRID_COLS
+from sim_store import SimStore
+
+params = dict(a=1.5, b=30., pct_minority=0.1, segregation_factor=0.5, K=50, N=10_000, epsilon=0.5)
+
+def test_main_and_main_batch_share_a_store(tmp_path):
+    path = str(tmp_path / 'store')
+    batch = main_batch([params], n_reps=3, seed=0, store=path)
+    main(seed=1, store=path, **params)
+    main_batch([params], n_reps=2, seed=2, store=path)
+
+    store = SimStore(path)
+    assert store.columns == STORE_COLS
+    assert len(store) == 6
+    agg = store.aggregates()
+    assert len(agg) == 1 and agg['count'].iloc[0] == 6
+    # the batch rows went in unchanged
+    np.testing.assert_allclose(store.read().iloc[:3][STORE_COLS].to_numpy(dtype=float),
+                               batch[STORE_COLS].to_numpy(dtype=float))
+
+def test_main_first_then_main_batch(tmp_path):
+    path = str(tmp_path / 'store')
+    main(seed=1, store=path, **params)
+    main_batch([params], n_reps=2, seed=2, store=path)
+    assert len(SimStore(path)) == 3
+    assert list(SimStore(path).aggregates()[GRID_COLS].iloc[0]) == [params[i] for i in GRID_COLS]
+
+def test_int_and_float_params_share_configurations(tmp_path):
+    path = str(tmp_path / 'store')
+    ints = dict(params, a=2, b=30, epsilon=1, segregation_factor=1)
+    main(seed=1, store=path, **ints)
+    main(seed=2, store=path, **dict(ints, epsilon=0.5, a=1.5))
+    main(seed=3, store=path, **dict(ints, epsilon=1.0, a=2.0, b=30.0))
+
+    agg = SimStore(path).aggregates().sort_values('epsilon')
+    assert agg.epsilon.tolist() == [0.5, 1.0]
+    assert agg.a.tolist() == [1.5, 2.0]
+    assert agg['count'].tolist() == [1, 2]
+
+def test_values_that_dont_fit_the_column_raise(tmp_path):
+    store = SimStore(str(tmp_path / 'store'), param_cols=['k'])
+    store.append(pd.DataFrame({'k': [1, 2], 'x': [1., 2.]}))
+    try:
+        store.append(pd.DataFrame({'k': [2.5], 'x': [3.]}))
+    except Exception as e:
+        assert "can't be stored exactly" in str(e)
+    else:
+        raise AssertionError("2.5 went into an int column")
+    store.append(pd.DataFrame({'k': [3.0], 'x': [3.]}))
+    assert SimStore(str(tmp_path / 'store')).read().k.tolist() == [1, 2, 3]
@@ -0,0 +1,31 @@
+import numpy as np, pandas as pd
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sweep import run_sweep
+from sim_store import SimStore
+
+grid = [dict(a=1.5, b=30., pct_minority=0.1, segregation_factor=0.5, K=50, N=10_000, epsilon=0.5),
+        dict(a=1.5, b=30., pct_minority=0.2, segregation_factor=0.5, K=50, N=10_000, epsilon=0.5)]
+
+def test_sweeps_sharing_a_store_keep_their_own_batches(tmp_path):
+    store = str(tmp_path / 'store')
+    run_sweep(grid, 3, root_seed=0, out_dir=str(tmp_path / 'sweep0'), n_workers=1, store=store)
+    run_sweep(grid, 3, root_seed=1, out_dir=str(tmp_path / 'sweep1'), n_workers=1, store=store)
+    assert len(SimStore(store)) == 12
+
+    # resuming (or re-running the same sweep elsewhere) adds nothing
+    run_sweep(grid, 3, root_seed=1, out_dir=str(tmp_path / 'sweep1'), n_workers=1, store=store)
+    run_sweep(grid, 3, root_seed=0, out_dir=str(tmp_path / 'sweep0_again'), n_workers=1, store=store)
+    assert len(SimStore(store)) == 12
+    assert (SimStore(store).aggregates()['count'] == 6).all()
+
+def test_resume_with_another_backend_is_refused(tmp_path):
+    out_dir = str(tmp_path / 'sweep')
+    run_sweep(grid[:1], 2, root_seed=0, out_dir=out_dir, n_workers=1)
+    try:
+        run_sweep(grid[:1], 2, root_seed=0, out_dir=out_dir, n_workers=1, backend='ipopt')
+    except Exception as e:
+        assert 'different sweep' in str(e)
+    else:
+        raise AssertionError("resumed a numpy sweep with backend='ipopt'")
@@ -0,0 +1,115 @@
+import pandas as pd, numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from geocodes import LEVELS, parent_code
+from geo_hierarchy import GeoHierarchy
+from projection import project_simplex, project_simplex_segments
+from noise import two_sided_geometric
+
+"""Goal: top-down post-processing like the DAS: state, then county, then tract, then block.
+
+Every level gets its own noisy counts. The top level is projected onto the control total, and
+then each level's units are projected, sibling group by sibling group, onto
+{x >= 0, sum(x) == parent's post-processed count}. Codes are key prefixes (see geocodes), so once
+sorted the siblings under each parent are contiguous and a whole level is one
+project_simplex_segments call. Levels depend on each other and run in order; big levels are
+split at parent boundaries into chunks that are solved in a process pool.
+"""
+
+DAS_LEVELS = ['state', 'county', 'tract', 'block']
+
+def top_down(hierarchy, noisy, total = None, levels = DAS_LEVELS, n_workers = 1, min_parallel = 1_000_000):
+    """ post-process noisy counts level by level so children sum to their parent
+
+    Parameters
+    ----------
+    hierarchy : GeoHierarchy built from the block geokeys (e.g. process_decennial.add_geoid output)
+    noisy : dict level -> pd.Series of noisy counts indexed by that level's code
+            (block level: geokey), with a value for every code in hierarchy.codes[level]
+    total : control total for the top level; None just clips the top level at 0
+    levels : spine levels to solve, coarsest first
+    n_workers : process pool size for levels with at least min_parallel units; 1 = no pool
+    min_parallel : smallest level worth splitting across the pool
+
+    Results
+    -------
+    returns dict level -> pd.Series of post-processed counts indexed by code
+    """
+    levels = sorted(levels, key=LEVELS.index)
+    out = {}
+    parent_level, parent_counts = None, None
+
+    with ProcessPoolExecutor(max_workers=n_workers) if n_workers != 1 else _NoPool() as pool:
+        for level in levels:
+            codes = hierarchy.codes[level]
+            if level not in noisy:
+                raise Exception("oops; no noisy counts for level " + level)
+            v = noisy[level].reindex(codes).to_numpy(dtype=float)
+            if np.isnan(v).any():
+                raise Exception("oops; noisy counts for " + level + " are missing some codes")
+
+            if parent_level is None:
+                x = np.maximum(v, 0) if total is None else project_simplex(v, total)
+            else:
+                # codes are sorted, so each parent's children are one contiguous run
+                parents = parent_code(codes, level, parent_level)
+                starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+                totals = parent_counts[np.searchsorted(hierarchy.codes[parent_level], parents[starts])]
+                x = _solve_level(pool, v, starts, totals, n_workers, min_parallel)
+
+            out[level] = pd.Series(x, index=pd.Index(codes, name=level), name='nn_counts')
+            parent_level, parent_counts = level, x
+    return out
+
+def noisy_rollups(hierarchy, block_counts, eps, levels = DAS_LEVELS, rng = None):
+    """ exact counts at every level from block counts, plus two-sided geometric noise
+
+    Parameters
+    ----------
+    hierarchy : GeoHierarchy
+    block_counts : per-block counts, in the row order the hierarchy was built with
+    eps : float, or dict level -> float for a per-level privacy-loss budget
+    levels : spine levels to make counts for
+    rng : np.random.Generator
+
+    Results
+    -------
+    returns (exact, noisy), each a dict level -> pd.Series indexed by code
+    """
+    sums = hierarchy.rollup_all(hierarchy.sort_values(block_counts), levels)
+    exact, noisy = {}, {}
+    for level, (codes, vals) in sums.items():
+        level_eps = eps[level] if isinstance(eps, dict) else eps
+        index = pd.Index(codes, name=level)
+        exact[level] = pd.Series(vals, index=index, name='counts')
+        noisy[level] = pd.Series(vals + two_sided_geometric(level_eps, size=len(vals), rng=rng),
+                                 index=index, name='noisy_counts')
+    return exact, noisy
+
+def _solve_level(pool, v, starts, totals, n_workers, min_parallel):
+    """ project_simplex_segments, split at segment boundaries into one chunk per worker
+    """
+    n_chunks = os.cpu_count() if n_workers is None else n_workers
+    if n_chunks == 1 or len(v) < min_parallel or len(starts) < 2:
+        return project_simplex_segments(v, starts, totals)
+
+    # segment index each chunk starts at, so chunks hold about the same number of units
+    cuts = np.unique(np.searchsorted(starts, np.linspace(0, len(v), n_chunks + 1)[1:-1], side='right') - 1)
+    cuts = np.concatenate([[0], cuts[cuts > 0], [len(starts)]])
+    bounds = np.append(starts, len(v))
+
+    jobs = []
+    for i in range(len(cuts) - 1):
+        lo, hi = cuts[i], cuts[i+1]
+        jobs.append(pool.submit(project_simplex_segments, v[bounds[lo]:bounds[hi]],
+                                starts[lo:hi] - bounds[lo], totals[lo:hi]))
+    return np.concatenate([i.result() for i in jobs])
+
+class _NoPool(object):
+    ''' stand-in for the executor when everything runs in this process
+    '''
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False